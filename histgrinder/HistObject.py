@@ -1,11 +1,78 @@
-from typing import Any
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+from collections import OrderedDict
+import threading
+
+
+# Handle for a histogram which is only read when first needed
+class Loader(ABC):
+    # optional bounded cache of loaded objects, shared by all loaders
+    cache: Optional['LoaderCache'] = None
+    # serializes loading and the cache between threads (--jobs, --pipeline);
+    # input modules also hold it while they use the file loaders read from
+    lock = threading.RLock()
+
+    def __init__(self):
+        self.obj = None
+
+    @abstractmethod
+    def load(self) -> Any:
+        """ Read the object. To be implemented by input modules. """
+        return
+
+    def get(self) -> Any:
+        with Loader.lock:
+            if self.obj is None:
+                self.obj = self.load()
+                if Loader.cache is not None:
+                    Loader.cache.add(self)
+            elif Loader.cache is not None:
+                Loader.cache.touch(self)
+            return self.obj
+
+
+# Least-recently-used set of loaders holding objects
+class LoaderCache(object):
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries: 'OrderedDict[int, Loader]' = OrderedDict()
+
+    def add(self, loader: Loader) -> None:
+        self.entries[id(loader)] = loader
+        while len(self.entries) > self.maxsize:
+            _, oldest = self.entries.popitem(last=False)
+            oldest.obj = None
+
+    def touch(self, loader: Loader) -> None:
+        if id(loader) in self.entries:
+            self.entries.move_to_end(id(loader))
+        else:
+            self.add(loader)
 
 
 # Object to hold histogram name & object
 class HistObject(object):
     def __init__(self, name: str, hist: Any):
         self.name = name
-        self.hist = hist
+        self._hist = hist
+
+    @property
+    def hist(self) -> Any:
+        """ The histogram; read on first access if it was given as a Loader """
+        if isinstance(self._hist, Loader):
+            return self._hist.get()
+        return self._hist
+
+    @hist.setter
+    def hist(self, hist: Any) -> None:
+        self._hist = hist
+
+    @property
+    def available(self) -> bool:
+        """ Whether there is a histogram (loaded or not), without loading it """
+        return self._hist is not None
 
     def __str__(self):
+        if isinstance(self._hist, Loader) and self._hist.obj is None:
+            return f"unloaded object {self.name}"
         return f"{type(self.hist).__name__} object {self.name}"
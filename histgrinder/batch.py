@@ -0,0 +1,74 @@
+# Support for transformations which handle all their groups in one call
+from .HistObject import HistObject
+from typing import Any, Dict, List, Tuple
+
+
+def to_array(hist: Any) -> Any:
+    """ Bin contents of a histogram as a 1D NumPy array """
+    if hasattr(hist, 'GetArray'):
+        from .io.rootnumpy import flat
+        return flat(hist)
+    import numpy as np
+    return np.ravel(np.asarray(hist))
+
+
+def from_array(template: Any, values: Any) -> Any:
+    """ A histogram like template, holding values """
+    if hasattr(template, 'GetArray'):
+        from .io.rootnumpy import from_flat
+        return from_flat(template, values)
+    return values
+
+
+class HistBatch(object):
+    """
+    The valid input combinations of all ready groups of a Batch transformer.
+    The function gets the bin contents of every group stacked into an array
+    of shape (groups, inputs, bins), where the inputs of a group are its
+    histograms in iteration order, slot by slot; and a list, for each group,
+    of the dictionaries of matched values.
+    """
+    def __init__(self, hcis: List[Any]):
+        self.hcis = hcis
+        # first histogram of each group: the model for that group's outputs
+        self.templates = [next(iter(_))[1][0] for _ in hcis]
+
+    def __len__(self):
+        return len(self.hcis)
+
+    def arrays(self) -> Tuple[Any, List[List[Dict[str, str]]]]:
+        import numpy as np
+        groups = []
+        rows = []
+        for hci in self.hcis:
+            entries = list(hci)
+            groups.append([_[0] for _ in entries])
+            rows.append([to_array(hist) for _, hists in entries for hist in hists])
+        if len({len(_) for _ in rows}) > 1 or len({a.shape for row in rows for a in row}) > 1:
+            raise ValueError('Batch transformations need the same number of inputs '
+                             'and of bins in every group')
+        return np.stack([np.stack(row) for row in rows]), groups
+
+    def split(self, result: Any, noutputs: int) -> List[List[Any]]:
+        """ Turn a (groups, outputs, bins) array into histograms for each group """
+        import numpy as np
+        result = np.asarray(result)
+        if result.ndim != 3 or result.shape[:2] != (len(self.hcis), noutputs):
+            raise ValueError(f'return value of shape {result.shape}, but ({len(self.hcis)}, '
+                             f'{noutputs}, bins) was expected')
+        return [[from_array(template, values) for values in group]
+                for template, group in zip(self.templates, result)]
+
+
+def batch_outputs(transformer, batch: HistBatch, result: Any) -> List[HistObject]:
+    """ Name the outputs of a Batch transformation function """
+    try:
+        hists = batch.split(result, len(transformer.tc.output))
+    except ValueError as e:
+        raise ValueError(f'Function {transformer.tc.function} gave a {e}')
+    rv = []
+    for hci, ohists in zip(batch.hcis, hists):
+        groupvalues = dict(zip(transformer.regextupnames[0], hci.tuples[0]))
+        rv.extend(HistObject(foname.format(**groupvalues), ohist)
+                  for foname, ohist in zip(transformer.tc.output, ohists))
+    return rv
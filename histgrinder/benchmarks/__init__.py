@@ -0,0 +1,2 @@
+# Benchmarks for the histgrinder engine. Run as e.g.
+# python -m histgrinder.benchmarks.dispatch
@@ -0,0 +1,51 @@
+# Generated configurations over the names of SyntheticInputModule
+from typing import Any, Dict, List
+
+FUNCTION = 'histgrinder.benchmarks.configs.count_inputs'
+
+
+def count_inputs(inputs):
+    """ Benchmark transform function: one output, the number of input combinations """
+    return [sum(1 for _ in inputs)]
+
+
+def _block(scenario: str, i: int) -> Dict[str, Any]:
+    if scenario == 'mixed':
+        scenario = SCENARIOS[i % (len(SCENARIOS) - 1)]
+    if scenario == 'single':
+        # one output per input histogram
+        inputs = [f'det{i}/hist_(?P<id>\\d+)']
+        outputs = [f'det{i}/copy_{{id}}']
+    elif scenario == 'join':
+        # two-slot join on a shared group
+        inputs = [f'det{i}/hist_(?P<id>\\d+)', f'det{i}/ref_(?P<id>\\d+)']
+        outputs = [f'det{i}/ratio_{{id}}']
+    elif scenario == 'reduce':
+        # all histograms of a directory into one output
+        inputs = [f'det{i}/hist_(?P<id>\\d+)']
+        outputs = [f'det{i}/summary']
+    elif scenario == 'groups':
+        # many-to-one reductions into ten groups per directory
+        inputs = [f'det{i}/(?P<kind>hist|ref)_(?P<id>\\d*)(?P<digit>\\d)']
+        outputs = [f'det{i}/{{kind}}_group{{digit}}']
+    else:
+        raise ValueError(f'Unknown benchmark scenario {scenario}')
+    return {'Input': inputs, 'Output': outputs, 'Function': FUNCTION,
+            'Description': f'{scenario}{i}'}
+
+
+# the last entry combines the others
+SCENARIOS = ['single', 'join', 'reduce', 'groups', 'mixed']
+
+
+def make_yaml(scenario: str, blocks: int) -> str:
+    """ YAML configuration with one block per detector directory """
+    import yaml
+    return yaml.safe_dump_all([_block(scenario, i) for i in range(blocks)])
+
+
+def make_configuration(scenario: str, blocks: int) -> List:
+    """ TransformationConfigurations parsed from make_yaml() """
+    import io
+    from ..config import read_configuration
+    return read_configuration(io.StringIO(make_yaml(scenario, blocks)))
@@ -0,0 +1,59 @@
+# Compare per-transformer regex matching with the Dispatcher index
+
+
+def make_transformers(nblocks):
+    """ Build nblocks transformers over a synthetic detector namespace """
+    from histgrinder.config import TransformationConfiguration
+    from histgrinder.transform import Transformer
+    rv = []
+    for i in range(nblocks):
+        if i % 3 == 0:
+            inputs = [f'det{i}/hist_(?P<id>\\d+)']
+            outputs = [f'det{i}/summary']
+        elif i % 3 == 1:
+            inputs = [f'det{i}/hist_(?P<id>\\d+)', f'det{i}/ref_(?P<id>\\d+)']
+            outputs = [f'det{i}/ratio_{{id}}']
+        else:
+            inputs = [f'det{i}/hist_7', f'det{i}/hist_3']
+            outputs = [f'det{i}/special']
+        rv.append(Transformer(TransformationConfiguration(
+            Input=inputs, Output=outputs, Function='histgrinder.example.nop',
+            Description=f'Block{i}')))
+    return rv
+
+
+def make_names(nblocks, nhists):
+    return [f'det{i}/{kind}_{j}' for i in range(nblocks)
+            for kind in ('hist', 'ref') for j in range(nhists)]
+
+
+def run(nblocks, nhists=10):
+    """ Return (naive seconds, dispatcher seconds) for one warmup-style pass """
+    import time
+    from histgrinder.HistObject import HistObject
+    from histgrinder.transform import Dispatcher
+    objs = [HistObject(_, None) for _ in make_names(nblocks, nhists)]
+
+    transformers = make_transformers(nblocks)
+    start = time.perf_counter()
+    for obj in objs:
+        for t in transformers:
+            t.consider(obj, defer=True)
+    naive = time.perf_counter() - start
+
+    transformers = make_transformers(nblocks)
+    start = time.perf_counter()
+    dispatcher = Dispatcher(transformers)
+    for obj in objs:
+        dispatcher.consider(obj, defer=True)
+    indexed = time.perf_counter() - start
+    return naive, indexed
+
+
+if __name__ == '__main__':  # pragma: no cover
+    import sys
+    sizes = [int(_) for _ in sys.argv[1:]] or [10, 100, 300, 1000]
+    print(f"{'blocks':>8} {'names':>8} {'naive (s)':>12} {'dispatch (s)':>12} {'speedup':>8}")
+    for n in sizes:
+        naive, indexed = run(n)
+        print(f"{n:>8} {n*20:>8} {naive:>12.3f} {indexed:>12.3f} {naive/indexed:>8.1f}")
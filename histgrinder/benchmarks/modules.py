@@ -0,0 +1,92 @@
+# In-memory input and output modules for benchmarking the engine without ROOT
+from ..interfaces import InputModule, OutputModule
+from ..HistObject import HistObject
+from ..patterns import PatternIndex
+from typing import Any, Collection, Generator, Iterable, Mapping, Pattern, Union
+
+
+def parse_source(source: str) -> Mapping[str, int]:
+    """ Turn a source string like 'blocks=100,hists=1000' into options """
+    rv = {}
+    for item in source.split(','):
+        if not item:
+            continue
+        key, _, value = item.partition('=')
+        rv[key.strip()] = int(value)
+    return rv
+
+
+class SyntheticInputModule(InputModule):
+    """
+    Generates names of dummy histograms, det{i}/hist_{j} and det{i}/ref_{j}
+    for i < blocks and j < hists, without storing them. The histogram is the
+    integer j.
+    """
+    def __init__(self):
+        self.blocks = 10
+        self.hists = 10
+        self.selectorindex = None
+        self.nlisted = 0
+
+    def configure(self, options: Mapping[str, Any]) -> None:
+        """
+        Configure this module. Potential elements of "options":
+        source: a string like 'blocks=100,hists=1000' (so that the module
+            can be driven from the command line of histgrinder.engine).
+        blocks: number of detector directories. Default 10.
+        hists: number of histograms of each kind per directory. Default 10.
+        """
+        settings = dict(parse_source(options.get('source', '')))
+        settings.update({k: options[k] for k in ('blocks', 'hists') if k in options})
+        self.blocks = int(settings.get('blocks', self.blocks))
+        self.hists = int(settings.get('hists', self.hists))
+
+    def setSelectors(self, selectors: Collection[Pattern]) -> None:
+        self.selectorindex = PatternIndex((_, None) for _ in selectors)
+
+    def __len__(self):
+        return 2 * self.blocks * self.hists
+
+    def names(self) -> Generator[str, None, None]:
+        for i in range(self.blocks):
+            for kind in ('hist', 'ref'):
+                for j in range(self.hists):
+                    name = f'det{i}/{kind}_{j}'
+                    self.nlisted += 1
+                    if self.selectorindex is None or self.selectorindex.search(name):
+                        yield name
+
+    def iterate(self, dryrun: bool) -> Generator[HistObject, None, None]:
+        for name in self.names():
+            yield HistObject(name, None if dryrun else int(name.rsplit('_', 1)[1]))
+
+    def __iter__(self) -> Iterable[HistObject]:
+        return self.iterate(dryrun=False)
+
+    def statistics(self) -> Mapping[str, Any]:
+        return {'names_listed': self.nlisted}
+
+    def warmup(self) -> Iterable[HistObject]:
+        return self.iterate(dryrun=True)
+
+
+class NullOutputModule(OutputModule):
+    """ Counts published histograms and throws them away """
+    def __init__(self):
+        self.npublished = 0
+        self.nfinalized = 0
+
+    def configure(self, options: Mapping[str, Any]) -> None:
+        """ Accepts (and ignores) any options """
+        return
+
+    def publish(self, obj: Union[HistObject, Iterable[HistObject]]) -> None:
+        if isinstance(obj, HistObject):
+            obj = [obj]
+        self.npublished += sum(1 for _ in obj)
+
+    def finalize(self) -> None:
+        self.nfinalized += 1
+
+    def statistics(self) -> Mapping[str, Any]:
+        return {'objects_published': self.npublished}
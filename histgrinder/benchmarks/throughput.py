@@ -0,0 +1,92 @@
+# Engine throughput on synthetic inputs. Run as e.g.
+# python -m histgrinder.benchmarks.throughput --blocks 100 --hists 1000
+# Each scenario of histgrinder.benchmarks.configs is timed in three phases:
+#   consider:  warmup pass through the Dispatcher (no transformation)
+#   transform: one deferred pass over all groups, after accepting every input
+#   eventloop: engine.eventloop, transforming as inputs arrive
+from typing import Any, Dict, List
+
+
+def _setup(scenario: str, blocks: int, hists: int):
+    from histgrinder.transform import Transformer, Dispatcher
+    from .configs import make_configuration
+    from .modules import SyntheticInputModule, NullOutputModule
+    transformers = [Transformer(_) for _ in make_configuration(scenario, blocks)]
+    im = SyntheticInputModule()
+    im.configure({'blocks': blocks, 'hists': hists})
+    selectors = set()
+    for t in transformers:
+        selectors.update(t.inregexes)
+    im.setSelectors(selectors)
+    return transformers, Dispatcher(transformers), im, NullOutputModule()
+
+
+def _result(scenario: str, phase: str, names: int, transforms: int, seconds: float) -> Dict[str, Any]:
+    from histgrinder.memory import peak_rss
+    return {'scenario': scenario, 'phase': phase, 'names': names, 'transforms': transforms,
+            'seconds': seconds,
+            'names_per_s': names / seconds if seconds else 0.,
+            'transforms_per_s': transforms / seconds if seconds else 0.,
+            'peak_rss': peak_rss()}
+
+
+def run(scenario: str, blocks: int, hists: int) -> List[Dict[str, Any]]:
+    """ Time the three phases for one scenario; return one result per phase """
+    import argparse
+    import logging
+    import time
+    from histgrinder.engine import eventloop
+    from histgrinder.executor import SerialExecutor
+    rv = []
+
+    transformers, dispatcher, im, om = _setup(scenario, blocks, hists)
+    start = time.perf_counter()
+    nnames = 0
+    for obj in im.warmup():
+        dispatcher.consider(obj, defer=True)
+        nnames += 1
+    rv.append(_result(scenario, 'consider', nnames, 0, time.perf_counter() - start))
+
+    transformers, dispatcher, im, om = _setup(scenario, blocks, hists)
+    for obj in im:
+        dispatcher.consider(obj, defer=True)
+    start = time.perf_counter()
+    ntransforms = len(SerialExecutor().transform(transformers))
+    rv.append(_result(scenario, 'transform', 0, ntransforms, time.perf_counter() - start))
+
+    transformers, dispatcher, im, om = _setup(scenario, blocks, hists)
+    log = logging.getLogger(__name__)
+    start = time.perf_counter()
+    eventloop(im, om, transformers, argparse.Namespace(defer=False), log, dispatcher)
+    rv.append(_result(scenario, 'eventloop', nnames, om.npublished, time.perf_counter() - start))
+    return rv
+
+
+def main(argv=None) -> List[Dict[str, Any]]:
+    import argparse
+    import json
+    from .configs import SCENARIOS
+    parser = argparse.ArgumentParser(description='Measure histgrinder engine throughput')
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=SCENARIOS,
+                        help='Configurations to run')
+    parser.add_argument('--blocks', type=int, default=100, help='Configuration blocks (detector directories)')
+    parser.add_argument('--hists', type=int, default=100,
+                        help='Histograms of each kind per directory')
+    parser.add_argument('--json', metavar='FILE', help='Also write the results to FILE as JSON')
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'scenario':>10} {'phase':>10} {'names/s':>12} {'transforms/s':>14} {'seconds':>9} {'peak RSS (MB)':>14}")
+    for scenario in args.scenario:
+        for r in run(scenario, args.blocks, args.hists):
+            print(f"{r['scenario']:>10} {r['phase']:>10} {r['names_per_s']:>12.0f} "
+                  f"{r['transforms_per_s']:>14.0f} {r['seconds']:>9.3f} {r['peak_rss'] / 1e6:>14.1f}")
+            results.append(r)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'blocks': args.blocks, 'hists': args.hists, 'results': results}, f, indent=1)
+    return results
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,112 @@
+# On-disk memoization of transformation function results
+from typing import Any, Optional
+import logging
+
+
+class ResultCache(object):
+    """
+    Results of transformation functions, stored in a directory as one pickle
+    file per call. A call is identified by the function name, its Parameters,
+    and the matched values and content hash of every input histogram. Files
+    are touched when they are used; once the directory holds more than
+    maxbytes, the least recently used files are removed.
+    """
+    def __init__(self, directory: str, maxbytes: int = 1_000_000_000):
+        import os
+        self.directory = directory
+        self.maxbytes = maxbytes
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(_.stat().st_size for _ in os.scandir(directory) if _.name.endswith('.pkl'))
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def key(self, transformer, unit: Any) -> str:
+        """ Identifier of a call of transformer's function on unit (see Transformer.prepare) """
+        import hashlib
+        import pickle
+        from .batch import HistBatch
+        from .hashing import content_hash
+        hcis = unit.hcis if isinstance(unit, HistBatch) else [unit]
+        inputs = [(sorted(matches.items()), [content_hash(_) for _ in hists])
+                  for hci in hcis for matches, hists in hci]
+        return hashlib.sha1(pickle.dumps((transformer.tc.function,
+                                          sorted(transformer.tc.parameters.items()),
+                                          inputs), protocol=4)).hexdigest()
+
+    def _path(self, key: str) -> str:
+        import os.path
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def get(self, key: str) -> Optional[Any]:
+        """ The stored result for key, or None """
+        import os
+        import pickle
+        log = logging.getLogger(__name__)
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                rv = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            log.warning(f'Result cache: unable to read {path}: {e}')
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return rv
+
+    def put(self, key: str, result: Any) -> None:
+        """ Store result for key, then evict old entries if over the size limit """
+        import os
+        import pickle
+        log = logging.getLogger(__name__)
+        path = self._path(key)
+        try:
+            data = pickle.dumps(result, protocol=4)
+        except Exception as e:
+            log.warning(f'Result cache: unable to store a result: {e}')
+            return
+        tmppath = f'{path}.{os.getpid()}.tmp'
+        with open(tmppath, 'wb') as f:
+            f.write(data)
+        try:
+            self.size -= os.stat(path).st_size
+        except FileNotFoundError:
+            pass
+        os.replace(tmppath, path)
+        self.size += len(data)
+        self.stores += 1
+        if self.size > self.maxbytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        """ Remove least recently used entries until the cache fits in maxbytes """
+        import os
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        entries.sort()
+        self.size = sum(_[1] for _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.maxbytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+
+    def report(self) -> None:
+        """ Log cache statistics """
+        log = logging.getLogger(__name__)
+        total = self.hits + self.misses
+        rate = 100. * self.hits / total if total else 0.
+        log.info(f"Result cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), "
+                 f"{self.stores} stored, {self.evictions} evicted, {self.size} bytes in {self.directory}")
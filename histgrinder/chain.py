@@ -0,0 +1,129 @@
+# Feeding transformer outputs back into the matching stage
+from .HistObject import HistObject
+from typing import Dict, List, Sequence, Set, Tuple
+import logging
+
+
+class Chain(object):
+    """
+    Run transformers whose inputs are the outputs of other transformers in
+    the same job. Outputs are passed on by reference, without being written
+    out and read back in.
+
+    The dependency graph is found by pushing the output names each block
+    will produce (known from the warmup pass for blocks with fixed Output
+    patterns) through the dispatcher as if they were warmup inputs. Blocks
+    are then run in topological order; the outputs of VariableOutput blocks
+    are still routed at run time, but can't be planned for.
+    """
+    def __init__(self, transformers: Sequence, dispatcher, skip_intermediates: bool = False):
+        self.transformers = list(transformers)
+        self.dispatcher = dispatcher
+        self.skip_intermediates = skip_intermediates
+        self.edges: Dict[int, Set[int]] = {i: set() for i in range(len(self.transformers))}
+        self.levels: List[List] = [self.transformers]
+
+    def plan(self) -> List:
+        """
+        Work out the dependencies between transformers; return the
+        transformers in topological order. Raises ValueError on cycles.
+        """
+        log = logging.getLogger(__name__)
+        position = {id(t): i for i, t in enumerate(self.transformers)}
+        known: Set[str] = set()
+        frontier = list(range(len(self.transformers)))
+        for _ in range(len(self.transformers) + 1):
+            grown = set()
+            for i in frontier:
+                for name in self._outputnames(self.transformers[i]):
+                    if name in known:
+                        continue
+                    known.add(name)
+                    for t, matches in self.dispatcher.dispatch(name):
+                        t.accept(HistObject(name, None), matches, defer=True)
+                        self.edges[i].add(position[id(t)])
+                        grown.add(position[id(t)])
+            frontier = sorted(grown)
+            if not frontier:
+                break
+        # Kahn's algorithm, by levels, keeping configuration order within a level
+        indegree = {i: 0 for i in self.edges}
+        for i, targets in self.edges.items():
+            for j in targets:
+                indegree[j] += 1
+        level = [i for i in sorted(indegree) if indegree[i] == 0]
+        levels = []
+        while level:
+            levels.append(level)
+            nextlevel = []
+            for i in level:
+                for j in self.edges[i]:
+                    indegree[j] -= 1
+                    if indegree[j] == 0:
+                        nextlevel.append(j)
+            level = sorted(nextlevel)
+        if sum(len(_) for _ in levels) != len(self.transformers):
+            cyclic = [self.transformers[i].tc.description for i in sorted(indegree) if indegree[i] > 0]
+            raise ValueError(f"Transformations form a cycle: {', '.join(cyclic)}")
+        for t in self.transformers:
+            t.matchqueue.clear()
+        self.levels = [[self.transformers[i] for i in level] for level in levels]
+        log.info(f"Chaining {len(self.transformers)} transformations in {len(self.levels)} stages")
+        self.transformers = [t for level in self.levels for t in level]
+        self.dispatcher = type(self.dispatcher)(self.transformers)
+        return self.transformers
+
+    def _outputnames(self, t) -> Set[str]:
+        """ Names the transformer will produce for the groups it knows about """
+        if t.tc.variable_output:
+            return set()
+        rv = set()
+        for tuples in t.firstindex.values():
+            groupvalues = dict(zip(t.regextupnames[0], next(iter(tuples))))
+            for foname in t.tc.output:
+                try:
+                    rv.add(foname.format(**groupvalues))
+                except (KeyError, IndexError):
+                    # bad Output pattern; will be reported when the transformer runs
+                    pass
+        return rv
+
+    def route(self, outputs: Sequence[HistObject]) -> Tuple[List[HistObject], List]:
+        """
+        Offer outputs to the transformers (deferred); return the outputs to
+        publish and the transformers which received something, in order.
+        """
+        publish = []
+        touched = {}
+        for obj in outputs:
+            consumers = self.dispatcher.dispatch(obj.name)
+            for t, matches in consumers:
+                t.accept(obj, matches, defer=True)
+                touched[id(t)] = None
+            if not (consumers and self.skip_intermediates):
+                publish.append(obj)
+        return publish, [t for t in self.transformers if id(t) in touched]
+
+    def feed(self, outputs: Sequence[HistObject], executor) -> List[HistObject]:
+        """ Route outputs downstream and run the transformers they complete """
+        rv = []
+        for _ in range(len(self.transformers) + 1):
+            publish, touched = self.route(outputs)
+            rv.extend(publish)
+            if not touched:
+                return rv
+            outputs = executor.transform(touched)
+        raise ValueError("Transformation outputs keep feeding back into their inputs; "
+                         "check the configuration for cycles")
+
+    def run_deferred(self, executor) -> List[HistObject]:
+        """ The end-of-input pass of --defer, stage by stage """
+        rv = []
+        for level in self.levels:
+            publish, _ = self.route(executor.transform(level))
+            rv.extend(publish)
+        # anything still pending came from outputs the plan couldn't foresee
+        pending = [t for t in self.transformers if t.matchqueue or t.ready]
+        if pending:
+            rv.extend(self.feed(executor.transform(pending), executor))
+        return rv
@@ -0,0 +1,106 @@
+# Saving and restoring the matching state of a job
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+
+# bump when the format of checkpoint files changes
+VERSION = 1
+
+
+def _fingerprint(t) -> Tuple:
+    """ What must be the same for a transformer to take over a saved state """
+    tc = t.tc
+    return (tc.description, tuple(tc.input), tuple(tc.output), tc.function,
+            repr(sorted(tc.parameters.items())))
+
+
+class Checkpointer(object):
+    """
+    Periodically pickle the state of the transformers (held histograms and
+    pending matches, see Transformer.checkpoint()) and of the input module
+    (see InputModule.checkpoint()) to a file, and restore it when a job is
+    restarted.
+    """
+    def __init__(self, path: str, interval: float = 60.):
+        import time
+        self.path = path
+        self.interval = interval
+        self.lastsave = time.monotonic()
+        self.nsaves = 0
+
+    def save(self, transformers: Sequence, im) -> None:
+        """ Write a checkpoint (atomically replacing the previous one) """
+        import os
+        import pickle
+        import time
+        log = logging.getLogger(__name__)
+        start = time.perf_counter()
+        state = {'version': VERSION,
+                 'transformers': [(_fingerprint(t), t.checkpoint()) for t in transformers],
+                 'input': im.checkpoint()}
+        tmppath = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmppath, 'wb') as f:
+            pickle.dump(state, f, protocol=4)
+        os.replace(tmppath, self.path)
+        self.lastsave = time.monotonic()
+        self.nsaves += 1
+        log.debug(f'Checkpoint written to {self.path} in {time.perf_counter() - start:.3f} s')
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """ The saved state, or None if there is none (or it can't be used) """
+        import pickle
+        log = logging.getLogger(__name__)
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            log.info(f'No checkpoint at {self.path}; starting from scratch')
+            return None
+        except Exception as e:
+            log.warning(f'Unable to read checkpoint {self.path}: {e}; starting from scratch')
+            return None
+        if state.get('version') != VERSION:
+            log.warning(f'Checkpoint {self.path} has an unknown format; starting from scratch')
+            return None
+        return state
+
+    def restore(self, state: Dict[str, Any], transformers: Sequence, im) -> bool:
+        """
+        Give each transformer its saved state, and the input module its own.
+        The configuration must be the same as when the checkpoint was
+        written; if it isn't, nothing is restored and False is returned.
+        """
+        log = logging.getLogger(__name__)
+        saved: Dict[Tuple, List[Any]] = {}
+        for fingerprint, tstate in state['transformers']:
+            saved.setdefault(fingerprint, []).append(tstate)
+        if sorted(saved) != sorted({_fingerprint(t) for t in transformers}) \
+                or sum(len(_) for _ in saved.values()) != len(transformers):
+            log.warning(f'Checkpoint {self.path} is for a different configuration; starting from scratch')
+            return False
+        for t in transformers:
+            t.restore(saved[_fingerprint(t)].pop(0))
+        im.restore(state['input'])
+        log.info(f'Restored state of {len(transformers)} transformations from {self.path}')
+        return True
+
+    def wrap(self, inputs: Iterable, transformers: Sequence, im, om=None) -> Iterable:
+        """
+        Iterate over inputs, writing a checkpoint whenever the interval has
+        passed. Each checkpoint is written before the next input is handed
+        out, so it covers everything processed so far; the output module om
+        is flushed first, so that no output of those inputs is only queued.
+        """
+        import time
+        it = iter(inputs)
+        while True:
+            # before asking for the next input, which the input module may
+            # already record as read
+            if time.monotonic() - self.lastsave >= self.interval:
+                if om is not None:
+                    om.flush()
+                self.save(transformers, im)
+            try:
+                obj = next(it)
+            except StopIteration:
+                return
+            yield obj
@@ -1,11 +1,12 @@
 # Configuration utilities
-from typing import Union, IO, List, Any, Mapping
+from typing import Union, IO, List, Any, Mapping, Optional
 import logging
 
 
 class TransformationConfiguration(object):
     def __init__(self, Input: List[str], Function: str, Description: str, Output: List[str] = [],
-                 VariableOutput: bool = False, OutputDOF: List[str] = [], Parameters: Mapping[str, Any] = {}):
+                 VariableOutput: bool = False, OutputDOF: List[str] = [], Parameters: Mapping[str, Any] = {},
+                 Batch: bool = False):
         self.input = Input
         self.output = Output
         self.function = Function
@@ -13,12 +14,15 @@ class TransformationConfiguration(object):
         self.description = Description
         self.variable_output = VariableOutput
         self.output_dof = OutputDOF
+        self.batch = Batch
 
         # check for conflicting options
         if OutputDOF and not VariableOutput:
             raise ValueError('Cannot specify OutputDOF if not also setting VariableOutput: True.')
         if Output and VariableOutput:
             raise ValueError('Cannot specify Output if VariableOutput == True.')
+        if Batch and VariableOutput:
+            raise ValueError('Cannot specify Batch if VariableOutput == True.')
 
     def __repr__(self):
         if self.variable_output:
@@ -27,19 +31,89 @@ class TransformationConfiguration(object):
                     f"Function: {self.function}, Parameters: {self.parameters}")
         else:
             return (f"Description: {self.description}\nInput: {self.input}\n"
-                    f"Output: {self.output}\n"
+                    f"Output: {self.output}{', Batch: True' if self.batch else ''}\n"
                     f"Function: {self.function}, Parameters: {self.parameters}")
 
 
-def read_configuration(f: Union[str, IO]) -> List[TransformationConfiguration]:
+def _parse(stream: Union[str, IO]) -> List[Any]:
+    """ YAML documents of stream, using the C loader if available """
     import yaml
+    return list(yaml.load_all(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)))
+
+
+class ConfigurationCache(object):
+    """
+    Parsed configuration files, pickled beside each file as
+    .<filename>.histgrinder-cache. A cached file is used if the
+    modification time and size of the YAML file are unchanged, or if its
+    content hash is; otherwise the file is parsed and the cache rewritten.
+    Directories which can't be written to are simply not cached.
+    """
+    # bump when the format of the cache files changes
+    VERSION = 1
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cachename(path: str) -> str:
+        import os.path
+        dirname, basename = os.path.split(path)
+        return os.path.join(dirname, f'.{basename}.histgrinder-cache')
+
+    def load(self, path: str) -> List[Any]:
+        """ The YAML documents of the file at path """
+        import hashlib
+        import os
+        import pickle
+        log = logging.getLogger(__name__)
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cachename = self.cachename(path)
+        try:
+            with open(cachename, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['version'] != self.VERSION:
+                cached = None
+        except Exception:
+            cached = None
+        if cached is not None and cached['stamp'] == stamp:
+            self.hits += 1
+            return cached['docs']
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        if cached is not None and cached['digest'] == digest:
+            self.hits += 1
+            docs = cached['docs']
+        else:
+            self.misses += 1
+            docs = _parse(data.decode())
+        try:
+            tmpname = f'{cachename}.{os.getpid()}.tmp'
+            with open(tmpname, 'wb') as f:
+                pickle.dump({'version': self.VERSION, 'stamp': stamp, 'digest': digest, 'docs': docs},
+                            f, protocol=4)
+            os.replace(tmpname, cachename)
+        except OSError as e:
+            log.debug(f'Not caching configuration {path}: {e}')
+        return docs
+
+
+def read_configuration(f: Union[str, IO],
+                       cache: Optional[ConfigurationCache] = None) -> List[TransformationConfiguration]:
     if isinstance(f, str):
-        fobj = open(f, 'r')
+        if cache is not None:
+            docs = cache.load(f)
+        else:
+            with open(f, 'r') as fobj:
+                docs = _parse(fobj)
     else:
-        fobj = f
+        docs = _parse(f)
 
     rv = []
-    for doc in yaml.safe_load_all(fobj):
+    for doc in docs:
         try:
             rv.append(TransformationConfiguration(**doc))
         except TypeError as e:
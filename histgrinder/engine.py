@@ -1,10 +1,22 @@
 def go():
     """ Application entry point """
     import logging
+    import time
+
+    # duration of each startup phase
+    startup = {}
+    clock = [time.perf_counter()]
+
+    def lap(phase):
+        now = time.perf_counter()
+        startup[phase] = now - clock[0]
+        clock[0] = now
 
     import histgrinder
-    from histgrinder.config import read_configuration, lookup_name
-    from histgrinder.transform import Transformer
+    from histgrinder.config import read_configuration, lookup_name, ConfigurationCache
+    from histgrinder.transform import Transformer, Dispatcher
+    from histgrinder.executor import make_executor
+    lap('imports')
 
     # set up arguments
     from argparse import ArgumentParser
@@ -12,7 +24,9 @@ def go():
     parser = ArgumentParser(description="Histogram postprocessing script")
     parser.add_argument('-c', '--configfile', nargs='+',
                         help='YAML configuration file(s)')
-    parser.add_argument('source', help='Input source, e.g. ROOT file')
+    parser.add_argument('source', nargs='+',
+                        help='Input source(s), e.g. ROOT file; glob patterns and @FILE (one source per line) '
+                        'are expanded')
     parser.add_argument('target', help='Output target, e.g. ROOT file')
     parser.add_argument('--inmodule',
                         default='histgrinder.io.root.ROOTInputModule',
@@ -27,66 +41,329 @@ def go():
                                  'ERROR', 'CRITICAL'],
                         default='INFO')
     parser.add_argument('--defer', action='store_true', help='Defer processing of histograms until end of input loop')
+    parser.add_argument('--evict', action='store_true',
+                        help='Release input histograms once all transformations using them have run '
+                        '(implies --oncomplete)')
+    parser.add_argument('--lazy', action='store_true',
+                        help='Only read input histograms when a transformation needs them')
+    parser.add_argument('--lru', type=int, metavar='N',
+                        help='With --lazy, keep at most N lazily read histograms in memory')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='Reuse results of transformations on unchanged inputs, stored in DIR')
+    parser.add_argument('--cache-size', type=int, default=1_000_000_000, metavar='BYTES',
+                        help='With --cache, the size above which the least recently used results are removed')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='Write counters of each transformation and of the input and output to FILE as JSON')
+    parser.add_argument('--config-cache', action='store_true',
+                        help='Cache each parsed configuration file beside it, and use the cache while the file is unchanged')
+    parser.add_argument('--merge', choices=['overwrite', 'prefix', 'separate'],
+                        help='With several sources: write outputs of all sources under the same names (overwrite), '
+                        'under a directory named after each source (prefix, the default), or to a target '
+                        'per source (separate; the target must contain {label} or {index})')
+    parser.add_argument('--source-jobs', type=int, default=1,
+                        help='Number of processes to work on several sources at once')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes to split the transformations of a source between; each reads '
+                        'only the inputs of its own transformations')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Read, transform and write histograms in separate threads')
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help='With --pipeline, the number of items that may wait between two stages')
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help='Do not write outputs again if their content is the same as the version last written')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='Save the matching state of the job to FILE periodically and at the end')
+    parser.add_argument('--checkpoint-interval', type=float, default=60., metavar='SECONDS',
+                        help='With --checkpoint, the time between checkpoints during a pass over the input')
+    parser.add_argument('--resume', action='store_true',
+                        help='With --checkpoint, start from the saved state and only read inputs changed since')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Write a timeline of reads, matching, transformation calls and writes to FILE '
+                        'in Chrome trace event format')
     parser.add_argument('--delaywrite', action='store_true', help='Write histograms at once at end of job')
+    parser.add_argument('--watch', type=float, metavar='INTERVAL',
+                        help='Keep running, looking for changed input histograms every INTERVAL seconds')
+    parser.add_argument('--persistent-output', action='store_true',
+                        help='Keep the output open and write histograms in batches')
+    parser.add_argument('--flush-count', type=int,
+                        help='With --persistent-output, write once this many histograms are queued')
+    parser.add_argument('--flush-bytes', type=int,
+                        help='With --persistent-output, write once queued histograms reach this size')
+    parser.add_argument('--flush-interval', type=float,
+                        help='With --persistent-output, write if this many seconds have passed since the last write')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of workers to run transformation functions on')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread',
+                        help='Kind of worker for --jobs; the process backend is best with --defer')
+    parser.add_argument('--chain', action='store_true',
+                        help='Feed outputs of transformations to other transformations in the same job')
+    parser.add_argument('--skip-intermediates', action='store_true',
+                        help='With --chain, do not write outputs which are consumed by other transformations')
+    parser.add_argument('--oncomplete', action='store_true',
+                        help='Call each transformation once, when all the inputs found for it in warmup are present')
     args = parser.parse_args()
+    # a later pass would find the inputs released by an earlier one missing
+    if args.evict and (args.watch or args.resume):
+        parser.error('--evict can not be used with --watch or --resume')
+    lap('arguments')
+
+    # exit cleanly on SIGTERM, so that output is flushed and closed
+    import signal
+    import sys
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
 
     logging.basicConfig(level=args.loglevel,
                         format='%(asctime)s | %(name)s | %(levelname)s | %(message)s')  # noqa: E501
     log = logging.getLogger(__name__)
     log.info(f"Histgrinder {histgrinder.__version__}: histogram postprocessor")
 
+    if args.trace:
+        import atexit
+        from histgrinder import trace
+        # written however the job ends, including on errors and SIGTERM
+        atexit.register(trace.enable().write, args.trace)
+
+    from histgrinder.sources import expand_sources
+    sources = expand_sources(args.source)
+
     # read configuration & set up transformations
-    transformers = []
+    configcache = ConfigurationCache() if args.config_cache else None
+    configs = []
     for configfile in args.configfile:
-        config = read_configuration(configfile)
-        transformers += [Transformer(_) for _ in config]
+        configs += read_configuration(configfile, configcache)
+    lap('configuration')
+    transformers = [Transformer(_) for _ in configs]
     selectors = set()
     for transform in transformers:
         selectors.update(transform.inregexes)
+    lap('transformers')
+
+    if args.lazy and args.lru:
+        from histgrinder.HistObject import Loader, LoaderCache
+        Loader.cache = LoaderCache(args.lru)
+
+    if len(sources) > 1 or args.merge in ('prefix', 'separate'):
+        from histgrinder.sources import run_sources
+        if args.watch or args.checkpoint or args.workers > 1:
+            parser.error('--watch, --checkpoint and --workers need a single source')
+        log.info("Startup: " + ", ".join(f"{k} {v:.3f} s" for k, v in startup.items())
+                 + f"; {len(configs)} transformations, {len(sources)} sources")
+        run_sources(sources, configs, args, log)
+        log.info("Complete")
+        return
+
+    if args.workers > 1:
+        from histgrinder.workers import run_workers
+        if args.watch or args.checkpoint or args.chain:
+            parser.error('--workers can not be used with --watch, --checkpoint or --chain')
+        log.info("Startup: " + ", ".join(f"{k} {v:.3f} s" for k, v in startup.items())
+                 + f"; {len(configs)} transformations")
+        run_workers(sources[0], configs, args, log)
+        log.info("Complete")
+        return
 
     # Configure input
     im = lookup_name(args.inmodule)()
-    in_configuration = {'source': args.source}
-    if args.prefix:
-        in_configuration['prefix'] = args.prefix
-    im.configure(in_configuration)
+    im.configure(input_configuration(args, sources[0]))
     im.setSelectors(selectors)
 
     # Configure output
     om = lookup_name(args.outmodule)()
-    out_configuration = {'target': args.target, 'delay': args.delaywrite}
+    om.configure(output_configuration(args, args.target))
+    lap('modules')
+
+    dispatcher = Dispatcher(transformers)
+    lap('dispatcher')
+    cached = f" ({configcache.hits} of {len(args.configfile)} configuration files cached)" if configcache else ""
+    log.info("Startup: " + ", ".join(f"{k} {v:.3f} s" for k, v in startup.items())
+             + f"{cached}; {len(transformers)} transformations")
+
+    checkpointer = None
+    restored = []
+    restorefn = None
+    if args.checkpoint:
+        from histgrinder.checkpoint import Checkpointer
+        checkpointer = Checkpointer(args.checkpoint, args.checkpoint_interval)
+        state = checkpointer.load() if args.resume else None
+        if state is not None:
+            def restore(ts):
+                restored.append(checkpointer.restore(state, ts, im))
+            restorefn = restore
+    transformers, dispatcher, chain, tracker, cache = warmup(im, transformers, dispatcher, args, log, restorefn)
+    # after a restart, only read what changed since the checkpoint
+    inputs = im.rescan() if any(restored) else None
+    if checkpointer is not None and not args.pipeline:
+        inputs = checkpointer.wrap(im if inputs is None else inputs, transformers, im, om)
+
+    executor = make_executor(args.jobs, args.executor, args.defer)
+
+    log.info("Beginning loop")
+    start = time.perf_counter()
+    try:
+        eventloop(im, om, transformers, args, log, dispatcher, executor, chain, inputs)
+        if checkpointer is not None:
+            checkpointer.save(transformers, im)
+        if args.watch:
+            log.info(f"Watching input every {args.watch} s")
+            while True:
+                time.sleep(args.watch)
+                inputs = im.rescan()
+                if checkpointer is not None and not args.pipeline:
+                    inputs = checkpointer.wrap(inputs, transformers, im, om)
+                eventloop(im, om, transformers, args, log, dispatcher, executor, chain, inputs)
+                if checkpointer is not None:
+                    checkpointer.save(transformers, im)
+                if args.trace:
+                    # the job may never exit normally, so keep the file current
+                    from histgrinder import trace
+                    trace.tracer.write(args.trace)
+    except KeyboardInterrupt:
+        if not args.watch:
+            raise
+        log.info("Interrupted")
+    finally:
+        executor.shutdown()
+        im.close()
+        if tracker is not None:
+            tracker.report()
+        if cache is not None:
+            cache.report()
+        if args.stats:
+            from histgrinder import stats
+            report = stats.collect(dispatcher, im, om, time.perf_counter() - start, startup)
+            stats.write(report, args.stats)
+            log.info(f"Statistics written to {args.stats}\n{stats.format_table(report)}")
+    log.info("Complete")
+
+
+def input_configuration(args, source):
+    """ Options for the input module reading source """
+    rv = {'source': source}
+    if args.prefix:
+        rv['prefix'] = args.prefix
+    if args.watch:
+        rv['checksum'] = True
+    if args.lazy:
+        rv['lazy'] = True
+    if args.pipeline:
+        rv['threads'] = True
+    return rv
+
+
+def output_configuration(args, target):
+    """ Options for the output module writing target """
+    rv = {'target': target, 'delay': args.delaywrite, 'skip_unchanged': args.skip_unchanged,
+          'persistent': args.persistent_output,
+          'flush_count': args.flush_count, 'flush_bytes': args.flush_bytes,
+          'flush_interval': args.flush_interval}
     if args.prefix:
-        out_configuration['prefix'] = args.prefix
-    om.configure(out_configuration)
+        rv['prefix'] = args.prefix
+    if args.pipeline:
+        rv['threads'] = True
+    return rv
 
-    # Warmup
+
+def warmup(im, transformers, dispatcher, args, log, restore=None):
+    """
+    Run the warmup pass and set up the options which depend on it.
+    If given, restore(transformers) is called after the warmup pass (to load
+    a checkpoint). Returns (transformers, dispatcher, chain, eviction
+    tracker, result cache), the last three None if not enabled.
+    """
     log.info("Warmup")
     for obj in im.warmup():
+        dispatcher.consider(obj)
+    if restore is not None:
+        restore(transformers)
+    chain = None
+    if args.chain:
+        from histgrinder.chain import Chain
+        chain = Chain(transformers, dispatcher, args.skip_intermediates)
+        transformers = chain.plan()
+        dispatcher = chain.dispatcher
+    if args.oncomplete or args.evict:
         for _ in transformers:
-            _.consider(obj)
+            _.catalog()
+    tracker = None
+    if args.evict:
+        from histgrinder.memory import EvictionTracker
+        tracker = EvictionTracker(transformers)
 
-    log.info("Beginning loop")
-    eventloop(im, om, transformers, args, log)
-    log.info("Complete")
+    cache = None
+    if args.cache:
+        from histgrinder.cache import ResultCache
+        cache = ResultCache(args.cache, args.cache_size)
+        for _ in transformers:
+            _.cache = cache
+    return transformers, dispatcher, chain, tracker, cache
 
 
-def eventloop(im, om, transformers, args, log):
+def eventloop(im, om, transformers, args, log, dispatcher=None, executor=None, chain=None,
+              inputs=None):
+    from histgrinder.transform import Dispatcher
+    from histgrinder.executor import SerialExecutor
+    if dispatcher is None:
+        dispatcher = Dispatcher(transformers)
+    if executor is None:
+        executor = SerialExecutor()
+    if getattr(args, 'pipeline', False):
+        from histgrinder.pipeline import pipelined_eventloop
+        return pipelined_eventloop(im, om, transformers, args, log, dispatcher, executor, chain, inputs)
     # Event loop
-    for obj in im:
-        for _ in transformers:
-            v = _.consider(obj, defer=args.defer)
-            if v:
-                om.publish(v)
+    for obj in (im if inputs is None else inputs):
+        v = process(obj, dispatcher, executor, chain, args)
+        if v:
+            om.publish(v)
+        else:
+            om.poll()
+    v = process_end(transformers, executor, chain, args, log)
+    if v:
+        om.publish(v)
+
+    log.info("Finalizing output")
+    om.finalize()
+
+
+def process(obj, dispatcher, executor, chain, args):
+    """ Offer one input to the transformers; return the outputs to publish now """
+    from histgrinder import trace
+    touched = []
+    with trace.span('consider', 'match', input=obj.name):
+        for _, matches in dispatcher.dispatch(obj.name):
+            _.accept(obj, matches, defer=True)
+            touched.append(_)
+    if touched and not args.defer:
+        v = executor.transform(touched)
+        if chain is not None:
+            v = chain.feed(v, executor)
+        return v
+    return []
+
+
+def process_end(transformers, executor, chain, args, log):
+    """
+    At the end of a pass: run the transformations held back by --defer and
+    the groups still missing inputs (see Transformer.fire_incomplete());
+    return their outputs
+    """
+    incomplete = [t for t in transformers if t.fire_incomplete()]
     if args.defer:
-        log.info("Processing deferred results")
-        for _ in transformers:
-            lv = _.transform()
-            for v in lv:
-                om.publish(v)
+        return process_deferred(transformers, executor, chain, log)
+    if not incomplete:
+        return []
+    log.info(f"Processing incomplete groups of {len(incomplete)} transformations")
+    v = executor.transform(incomplete)
+    if chain is not None:
+        v = chain.feed(v, executor)
+    return v
+
 
-    if args.delaywrite:
-        log.info("Finalizing output")
-        om.finalize()
+def process_deferred(transformers, executor, chain, log):
+    """ Run the transformations held back by --defer; return their outputs """
+    log.info("Processing deferred results")
+    if chain is not None:
+        return chain.run_deferred(executor)
+    return executor.transform(transformers)
 
 
 if __name__ == '__main__':  # pragma: no cover
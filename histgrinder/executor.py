@@ -0,0 +1,131 @@
+# Strategies for running transformation functions
+from .HistObject import HistObject
+from .batch import HistBatch
+from typing import Any, List, Sequence, Tuple
+import logging
+
+# (transformer, input combination) pairs of the batch being run by forked workers
+_PENDING: List[Tuple[Any, Any]] = []
+
+
+def _call_pending(idx: int) -> Any:
+    """ Worker side of the fork-based process backend """
+    t, hci = _PENDING[idx]
+    return t.timed_call(hci)
+
+
+def _call_function(function, args, parameters) -> Tuple[Any, float]:
+    """ Worker side of the process backend when fork is not available """
+    import time
+    start = time.perf_counter()
+    rv = function(*args, **parameters)
+    return rv, time.perf_counter() - start
+
+
+class SerialExecutor(object):
+    """ Run transformation functions one after the other in the calling thread """
+    def transform(self, transformers: Sequence[Any]) -> List[HistObject]:
+        """ Process the pending groups of each transformer; return outputs in order """
+        rv = []
+        for t in transformers:
+            rv.extend(t.transform())
+        return rv
+
+    def shutdown(self) -> None:
+        return
+
+
+class PoolExecutor(SerialExecutor):
+    """
+    Run the transformation functions of independent groups, from all
+    transformers, on a pool of threads or processes. Results are collected
+    in submission order, so the output is the same as for SerialExecutor.
+
+    With forkbatches (for the few large batches of --defer), the process
+    backend forks a fresh pool for each batch, so the workers inherit the
+    input histograms instead of receiving pickled copies; only return
+    values are pickled. Otherwise (for the many small batches of streaming
+    mode, where fork is not available, or while other threads such as the
+    reader of --pipeline are running) one spawned pool is kept for the whole
+    job, and the inputs of each group are pickled and passed to the
+    function as a plain list.
+    """
+    def __init__(self, jobs: int, backend: str = 'thread', forkbatches: bool = False):
+        import multiprocessing
+        if backend not in ('thread', 'process'):
+            raise ValueError(f'Unknown executor backend {backend}')
+        self.jobs = jobs
+        self.backend = backend
+        self.fork = forkbatches and 'fork' in multiprocessing.get_all_start_methods()
+        self.pool = None
+
+    def transform(self, transformers: Sequence[Any]) -> List[HistObject]:
+        units = [(t, hci) for t in transformers for hci in t.prepare()]
+        lookups = [t.lookup(hci) for t, hci in units]
+        # only the units without a cached result are run
+        calls = [unit for unit, (_, cached) in zip(units, lookups) if cached is None]
+        if len(calls) <= 1:
+            results = [t.timed_call(hci) for t, hci in calls]
+        elif self.backend == 'thread':
+            results = self._run_threads(calls)
+        else:
+            results = self._run_processes(calls)
+        results = iter(results)
+        rv = []
+        for (t, hci), (key, olist) in zip(units, lookups):
+            if olist is None:
+                olist, elapsed = next(results)
+                t.record(elapsed)
+                t.store(key, olist)
+            rv.extend(t.outputs(hci, olist))
+        return rv
+
+    def _run_threads(self, calls) -> List[Any]:
+        from concurrent.futures import ThreadPoolExecutor
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.jobs)
+        futures = [self.pool.submit(t.timed_call, hci) for t, hci in calls]
+        return [_.result() for _ in futures]
+
+    def _run_processes(self, calls) -> List[Any]:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        import threading
+        global _PENDING
+        log = logging.getLogger(__name__)
+        log.debug(f'Running {len(calls)} transformations on {self.jobs} processes')
+        # forking while another thread runs can copy locks it holds
+        if self.fork and threading.active_count() == 1:
+            # read lazily loaded inputs and look up functions first: workers
+            # must not share the open input file, nor each import the functions
+            for t, hci in calls:
+                t.transform_function
+                for group in (hci.hcis if isinstance(hci, HistBatch) else [hci]):
+                    list(group)
+            _PENDING = calls
+            try:
+                with ProcessPoolExecutor(max_workers=min(self.jobs, len(calls)),
+                                         mp_context=multiprocessing.get_context('fork')) as pool:
+                    futures = [pool.submit(_call_pending, idx) for idx in range(len(calls))]
+                    return [_.result() for _ in futures]
+            finally:
+                _PENDING = []
+        if self.pool is None:
+            # other threads (e.g. of --pipeline) may be running, which rules out fork
+            self.pool = ProcessPoolExecutor(max_workers=self.jobs, mp_context=multiprocessing.get_context('spawn'))
+        futures = [self.pool.submit(_call_function, t.transform_function,
+                                    hci.arrays() if isinstance(hci, HistBatch) else (list(hci),),
+                                    t.tc.parameters)
+                   for t, hci in calls]
+        return [_.result() for _ in futures]
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def make_executor(jobs: int, backend: str = 'thread', forkbatches: bool = False) -> SerialExecutor:
+    if jobs <= 1:
+        return SerialExecutor()
+    return PoolExecutor(jobs, backend, forkbatches)
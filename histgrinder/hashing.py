@@ -0,0 +1,12 @@
+# Content hashing of histogram objects
+from typing import Any
+
+
+def content_hash(obj: Any) -> str:
+    """
+    Digest of the serialized content of obj. Works for any picklable
+    object, including ROOT objects (which pickle through their streamers).
+    """
+    import hashlib
+    import pickle
+    return hashlib.sha1(pickle.dumps(obj, protocol=4)).hexdigest()
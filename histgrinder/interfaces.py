@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Mapping, Collection, Iterable, Union
+from typing import Any, Mapping, Collection, Iterable, Union
 from .HistObject import HistObject
 
 
@@ -30,6 +30,33 @@ class InputModule(ABC):
         """
         return None
 
+    def rescan(self) -> Iterable[HistObject]:
+        """
+        Used by long-running jobs to look at the source again. Should return
+        the histograms which are new or changed since the previous pass.
+        By default, everything is returned again.
+        """
+        return iter(self)
+
+    def close(self) -> None:
+        """ Release any resources (e.g. open files) held between passes """
+        return
+
+    def statistics(self) -> Mapping:
+        """ Counters (e.g. objects read, time spent) for the job statistics report """
+        return {}
+
+    def checkpoint(self) -> Any:
+        """
+        Picklable state needed by rescan() to return only what changed
+        since now, after a restart (see restore()).
+        """
+        return None
+
+    def restore(self, state: Any) -> None:
+        """ Take over the state returned by checkpoint() """
+        return
+
 
 # Interface for modules that write histograms to a sink
 class OutputModule(ABC):
@@ -46,3 +73,21 @@ class OutputModule(ABC):
     @abstractmethod
     def finalize(self) -> None:
         return
+
+    def poll(self) -> None:
+        """
+        Called regularly while the job is not publishing (e.g. waiting for
+        inputs), to write anything queued which is due.
+        """
+        return
+
+    def flush(self) -> None:
+        """
+        Write everything published so far, including what is queued for a
+        later write (e.g. before a checkpoint records the inputs as done).
+        """
+        return
+
+    def statistics(self) -> Mapping:
+        """ Counters (e.g. objects written, time spent) for the job statistics report """
+        return {}
@@ -0,0 +1,299 @@
+# Memory-mapped store of histogram bin arrays, readable without ROOT.
+#
+# File layout: a magic string, then a header giving the position and length
+# of the current JSON index, then the arrays of every histogram (each
+# contiguous and aligned to ALIGN bytes) and the indices written so far.
+# Writers only append arrays and indices; the header is rewritten last,
+# once a new index is complete. Readers follow the header, so a store can
+# be read while it is being written, and they see the histograms of the
+# last index written.
+from ..interfaces import InputModule, OutputModule
+from ..HistObject import HistObject
+from ..patterns import PatternIndex
+from typing import Any, Collection, Dict, Generator, Iterable, List, Mapping, Optional, Pattern, Union
+import logging
+import struct
+
+MAGIC = b'HGCOLv2\0'
+# index offset, index length; zero before the first index is written
+_HEADER = struct.Struct('<QQ')
+ALIGN = 64
+
+
+class ArrayHist(object):
+    """
+    A histogram as NumPy arrays: bin contents (values), optionally the sum
+    of squared weights (sumw2, same shape), and the bin edges along each
+    axis. If flow is True, the first and last bins along each axis are the
+    under/overflow bins, like ROOT's; edges never include them. Can be used
+    wherever an array of the contents is expected.
+    """
+    def __init__(self, values: Any, edges: Optional[List[Any]] = None, sumw2: Optional[Any] = None,
+                 flow: bool = False, title: str = ''):
+        import numpy as np
+        self.values = values
+        self.sumw2 = sumw2
+        self.flow = flow
+        self.title = title
+        if edges is None:
+            edges = [np.arange(n - 2 * flow + 1, dtype='f8') for n in values.shape]
+        self.edges = edges
+
+    @property
+    def ndim(self) -> int:
+        return self.values.ndim
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __array__(self, dtype=None, copy=None):
+        import numpy as np
+        return np.asarray(self.values, dtype=dtype)
+
+    def __repr__(self):
+        return f'ArrayHist(shape={self.shape}, flow={self.flow})'
+
+
+def to_arrayhist(hist: Any) -> ArrayHist:
+    """ ArrayHist from an ArrayHist, a ROOT histogram (zero-copy views) or anything array-like """
+    import numpy as np
+    if isinstance(hist, ArrayHist):
+        return hist
+    if hasattr(hist, 'GetArray'):
+        from .rootnumpy import contents, edges, sumw2
+        return ArrayHist(contents(hist), [edges(hist, axis) for axis in 'xyz'[:hist.GetDimension()]],
+                         sumw2(hist), flow=True, title=hist.GetTitle())
+    values = np.asarray(hist)
+    if values.dtype.hasobject:
+        raise TypeError('not an array of numbers')
+    return ArrayHist(values)
+
+
+def _read_index(f: Any) -> Dict[str, Any]:
+    """ Index of a store, from a file object (or mmap) positioned anywhere """
+    import json
+    import os
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    if size < len(MAGIC) + _HEADER.size or f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a histgrinder columnar store')
+    offset, length = _HEADER.unpack(f.read(_HEADER.size))
+    if not length:
+        return {}
+    if offset + length > size:
+        raise ValueError('Columnar store is damaged (index beyond the end of the file)')
+    f.seek(offset)
+    return json.loads(f.read(length).decode())
+
+
+def _view(buffer: Any, spec: Mapping[str, Any]) -> Any:
+    import numpy as np
+    count = int(np.prod(spec['shape'])) if spec['shape'] else 1
+    return np.frombuffer(buffer, dtype=spec['dtype'], count=count,
+                         offset=spec['offset']).reshape(spec['shape'])
+
+
+class ColumnarInputModule(InputModule):
+    def __init__(self):
+        self.source = None
+        self.prefix = ''
+        self.selectorindex = None
+        self.file = None
+        self.buffer = None
+        self.stamp = None
+        self.index: Dict[str, Any] = {}
+        self.nread = 0
+        self.nbytes = 0
+
+    def configure(self, options: Mapping[str, Any]) -> None:
+        """
+        Configure this module. Potential elements of "options":
+        source: path of the store.
+        prefix: directory path to search under. Returned histogram names
+            will not include this.
+        """
+        if 'source' not in options:
+            raise ValueError("Must specify 'source' as an "
+                             "option to ColumnarInputModule")
+        self.source = options['source']
+        self.prefix = options.get('prefix', '/').strip('/')
+
+    def setSelectors(self, selectors: Collection[Pattern]) -> None:
+        """ Only histograms whose names fully match one of the selectors will be returned """
+        self.selectorindex = PatternIndex((_, None) for _ in selectors)
+
+    def _map(self) -> None:
+        """ Memory-map the store, again if it has changed since it was last mapped """
+        import mmap
+        import os
+        st = os.stat(self.source)  # a missing store will raise OSError
+        stamp = (st.st_size, st.st_mtime_ns)
+        if stamp == self.stamp:
+            return
+        self.close()
+        self.file = open(self.source, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index = _read_index(self.buffer)
+        self.stamp = stamp
+
+    def names(self) -> Generator[str, None, None]:
+        """ Selected names in the index, without the prefix """
+        start = f'{self.prefix}/' if self.prefix else ''
+        for name in self.index:
+            if not name.startswith(start):
+                continue
+            name = name[len(start):]
+            if self.selectorindex is None or self.selectorindex.search(name):
+                yield name
+
+    def iterate(self, dryrun: bool) -> Generator[HistObject, None, None]:
+        log = logging.getLogger(__name__)
+        self._map()
+        start = f'{self.prefix}/' if self.prefix else ''
+        for name in self.names():
+            if dryrun:
+                yield HistObject(name, None)
+                continue
+            spec = self.index[start + name]
+            values = _view(self.buffer, spec['values'])
+            self.nread += 1
+            self.nbytes += values.nbytes
+            sumw2 = None
+            if spec.get('sumw2'):
+                sumw2 = _view(self.buffer, spec['sumw2'])
+                self.nbytes += sumw2.nbytes
+            edges = [_view(self.buffer, _) for _ in spec['edges']]
+            log.debug(f'Columnar input read {name}')
+            yield HistObject(name, ArrayHist(values, edges, sumw2, spec.get('flow', False),
+                                             spec.get('title', '')))
+
+    def __iter__(self) -> Iterable[HistObject]:
+        return self.iterate(dryrun=False)
+
+    def warmup(self) -> Iterable[HistObject]:
+        """ Iterate over the index only """
+        return self.iterate(dryrun=True)
+
+    def close(self) -> None:
+        if self.buffer is not None:
+            try:
+                self.buffer.close()
+            except BufferError:
+                # arrays handed out still use the mapping; it goes when they do
+                pass
+            self.file.close()
+            self.buffer = self.file = self.stamp = None
+
+    def statistics(self) -> Mapping[str, Any]:
+        """ Histograms in the index, histograms read and the size of their arrays """
+        return {'index_entries': len(self.index), 'objects_read': self.nread,
+                'bytes_mapped': self.nbytes}
+
+
+class ColumnarOutputModule(OutputModule):
+    def __init__(self):
+        self.target = None
+        self.file = None
+        self.index: Dict[str, Any] = {}
+        self.dirty = False
+        self.nwritten = 0
+        self.nbytes = 0
+
+    def configure(self, options: Mapping[str, Any]) -> None:
+        """
+        Configure this module. Potential elements of "options":
+        target: path of the store. An existing store is added to.
+        prefix: directory path to place results under.
+        Other options of the ROOT output module are accepted and ignored:
+        arrays are appended to the store as they are published, and the
+        index is written by finalize().
+        """
+        if 'target' not in options:
+            raise ValueError("Must specify 'target' as an option "
+                             "to ColumnarOutputModule")
+        self.target = options['target']
+        self.prefix = options.get('prefix', '/').strip('/')
+
+    def _open(self) -> None:
+        """ Open the store for appending, creating it if needed """
+        import os
+        if self.file is not None:
+            return
+        if os.path.exists(self.target) and os.path.getsize(self.target):
+            self.file = open(self.target, 'r+b')
+            self.index = _read_index(self.file)
+            self.file.seek(0, os.SEEK_END)
+            self.dirty = False
+        else:
+            self.file = open(self.target, 'w+b')
+            self.file.write(MAGIC)
+            self.file.write(_HEADER.pack(0, 0))
+            self.index = {}
+            # a new store needs an index even if nothing is published
+            self.dirty = True
+
+    def _append(self, array: Any) -> Dict[str, Any]:
+        """ Write array (contiguous, aligned); return its index entry """
+        import numpy as np
+        array = np.ascontiguousarray(array)
+        pos = self.file.tell()
+        padding = -pos % ALIGN
+        self.file.write(b'\0' * padding)
+        self.file.write(array.tobytes())
+        self.nbytes += array.nbytes
+        return {'offset': pos + padding, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    def publish(self, obj: Union[HistObject, Iterable[HistObject]]) -> None:
+        """ Append the arrays of histograms (ArrayHist, ROOT histogram or array-like) """
+        import os
+        log = logging.getLogger(__name__)
+        if isinstance(obj, HistObject):
+            obj = [obj]
+        self._open()
+        for o in obj:
+            try:
+                hist = to_arrayhist(o.hist)
+            except Exception as e:
+                log.error(f"Columnar output: unsupported object type {type(o.hist).__name__} ({e})")
+                continue
+            name = '/'.join(_ for _ in (self.prefix, o.name.strip('/')) if _)
+            self.index[name] = {'values': self._append(hist.values),
+                                'sumw2': self._append(hist.sumw2) if hist.sumw2 is not None else None,
+                                'edges': [self._append(_) for _ in hist.edges],
+                                'flow': hist.flow, 'title': hist.title}
+            self.nwritten += 1
+            self.dirty = True
+            log.debug(f"Columnar output: publishing {os.path.join(self.prefix, o.name)}")
+
+    def _write_index(self) -> None:
+        import json
+        import os
+        data = json.dumps(self.index, separators=(',', ':')).encode()
+        pos = self.file.tell()
+        self.file.write(data)
+        self.file.flush()
+        # only now point readers at the new index
+        self.file.seek(len(MAGIC))
+        self.file.write(_HEADER.pack(pos, len(data)))
+        self.file.flush()
+        self.file.seek(0, os.SEEK_END)
+        self.dirty = False
+
+    def flush(self) -> None:
+        """ Write the index of what has been published so far """
+        if self.file is not None and self.dirty:
+            self._write_index()
+
+    def finalize(self) -> None:
+        """ Write the index, making the published histograms visible to readers """
+        self._open()
+        if self.dirty:
+            self._write_index()
+        self.file.close()
+        self.file = None
+
+    def statistics(self) -> Mapping[str, Any]:
+        """ Histograms written and the size of their arrays """
+        return {'objects_written': self.nwritten, 'bytes_written': self.nbytes}
@@ -1,28 +1,106 @@
 from ..interfaces import InputModule, OutputModule
-from ..HistObject import HistObject
+from ..HistObject import HistObject, Loader
+from ..patterns import PatternIndex, PrefixFilter
+from ..hashing import content_hash
+from .. import trace
 from typing import (Union, Iterable, Mapping, Any, Collection,
-                    Pattern, Generator)
+                    Pattern, Generator, List, NamedTuple, Optional,
+                    Dict, Tuple)
 import logging
 
 
+class CatalogEntry(NamedTuple):
+    """ A selected key found by the warmup pass """
+    name: str
+    dirname: str
+    keyname: str
+    classname: str
+    cycle: int
+
+
 def readobj(k, dryrun):
     if not dryrun:
+        import ROOT
         obj = k.ReadObj()
         if hasattr(obj, 'SetDirectory'):
             obj.SetDirectory(0)
+        # let Python free the object once it is no longer referenced
+        ROOT.SetOwnership(obj, True)
     else:
         obj = None
     return obj
 
 
+def _import_root(threads: bool = False) -> Any:
+    """ Import ROOT when it is first needed, rather than when modules are created """
+    import ROOT
+    # allow for us to close the input file and keep the histograms live
+    ROOT.TH1.AddDirectory(ROOT.kFALSE)
+    if threads:
+        _enable_threads(ROOT)
+    return ROOT
+
+
+def _enable_threads(ROOT) -> None:
+    """ Allow reading and writing from different threads (see histgrinder.pipeline) """
+    ROOT.EnableThreadSafety()
+    # let other threads run while ROOT does I/O
+    ROOT.TKey.ReadObj.__release_gil__ = True
+    ROOT.TDirectory.WriteTObject.__release_gil__ = True
+
+
+def _getkey(indir, keyname: str, cycle: int) -> Any:
+    """
+    The key of cycle, or of the latest cycle if that one has gone (e.g. the
+    histogram was rewritten with WriteDelete); None if the name has gone
+    """
+    if not indir:
+        return None
+    return indir.GetKey(keyname, cycle) or indir.GetKey(keyname)
+
+
+def _signature(k) -> Tuple:
+    """ What identifies a version of a key: cycle, timestamp, size, location """
+    return (k.GetCycle(), k.GetDatime().Get(), k.GetNbytes(), k.GetSeekKey())
+
+
+class ROOTKeyLoader(Loader):
+    """ Reads a key of the input file when the histogram is first needed """
+    def __init__(self, module: 'ROOTInputModule', dirname: str, keyname: str, cycle: int):
+        super().__init__()
+        self.module = module
+        self.dirname = dirname
+        self.keyname = keyname
+        self.cycle = cycle
+
+    def load(self) -> Any:
+        import os.path
+        indir = self.module.infile.GetDirectory(os.path.join(self.module.prefix, self.dirname))
+        k = _getkey(indir, self.keyname, self.cycle)
+        if not k:
+            raise KeyError(f'ROOT input: {os.path.join(self.dirname, self.keyname)};{self.cycle} '
+                           'is no longer in the file')
+        return self.module._read(k)
+
+
 class ROOTInputModule(InputModule):
     def __init__(self):
         self.source = None
-        import ROOT
-        # allow for us to close the input file and keep the histograms live
-        ROOT.TH1.AddDirectory(ROOT.kFALSE)
         self.classwarnings = set()
         self.selectors = None
+        self.selectorindex = None
+        self.dirfilter = None
+        # keys found by warmup(), so that iteration needn't walk the file again
+        self.catalog: Optional[List[CatalogEntry]] = None
+        # name -> (key signature, content hash) as of the last read, for rescan()
+        self.signatures: Dict[str, Tuple[Tuple, Optional[str]]] = {}
+        # file kept open for lazily read histograms
+        self.infile = None
+        # counters for statistics()
+        self.nkeys = 0
+        self.nread = 0
+        self.nbytes = 0
+        self.readtime = 0.
 
     def configure(self, options: Mapping[str, Any]) -> None:
         """
@@ -30,52 +108,161 @@ class ROOTInputModule(InputModule):
         source: should be a ROOT-openable filename or URL.
         prefix: directory path to search under. Returned histogram names
             will not include this.
+        checksum: remember a hash of the content of each histogram read, so
+            that rescan() can skip histograms rewritten without changes.
+        lazy: only read a histogram when it is first used; the file stays
+            open until close() or the next pass. Ignored with checksum.
+        threads: other threads may do ROOT I/O at the same time.
         """
         if 'source' not in options:
             raise ValueError("Must specify 'source' as an "
                              "option to ROOTInputModule")
         self.source = options['source']
         self.prefix = options.get('prefix', '/')
+        self.checksum = bool(options.get('checksum', False))
+        self.lazy = bool(options.get('lazy', False)) and not self.checksum
+        self.threads = bool(options.get('threads', False))
+        self.catalog = None
+        self.signatures = {}
 
     def setSelectors(self, selectors: Collection[Pattern]) -> None:
-        """ Do more later """
+        """
+        Only histograms whose names fully match one of the selectors will
+        be returned; directories that none of them can reach are skipped.
+        """
         self.selectors = selectors
+        self.selectorindex = PatternIndex((_, None) for _ in selectors)
+        self.dirfilter = PrefixFilter(selectors)
+        self.catalog = None
 
-    def iterate(self, dryrun) -> Generator[HistObject, None, None]:
-        """ Open ROOT file; iterate over all histograms; close ROOT file """
-        import ROOT
+    def iterate(self, dryrun, catalog: Optional[List[CatalogEntry]] = None,
+                onlychanged: bool = False) -> Generator[HistObject, None, None]:
+        """
+        Open ROOT file; iterate over all histograms; close ROOT file.
+        If catalog is given, the selected keys are appended to it.
+        If onlychanged, skip histograms which haven't changed since last read.
+        """
+        ROOT = _import_root(self.threads)
         import os.path
         from collections import deque
         log = logging.getLogger(__name__)
-        infile = ROOT.TFile.Open(self.source)  # failure to open will raise OSError
+        lazy = self.lazy and not dryrun
+        infile = self._open() if lazy else ROOT.TFile.Open(self.source)  # failure to open will raise OSError
         dirqueue = deque([''])
+        seen = set()
         while dirqueue:
             dirname = dirqueue.popleft()
-            indir = infile.GetDirectory(os.path.join(self.prefix, dirname))
+            # loaders may be reading from the same file in other threads
+            with trace.span('list', 'read', directory=dirname), Loader.lock:
+                indir = infile.GetDirectory(os.path.join(self.prefix, dirname))
+                keys = list(indir.GetListOfKeys()) if indir else None
             if not indir:
                 log.critical("Access to invalid directory. "
                              f"This shouldn't happen ... dirname {dirname}")
                 continue
-            for k in indir.GetListOfKeys():
+            for k in keys:
+                self.nkeys += 1
                 classname = k.GetClassName()
                 if classname.startswith('TDirectory'):
-                    dirqueue.append(os.path.join(dirname, k.GetName()))
+                    subdirname = os.path.join(dirname, k.GetName())
+                    if self.dirfilter is None or self.dirfilter(subdirname):
+                        dirqueue.append(subdirname)
                     continue
+                objname = os.path.join(dirname, k.GetName())
+                if self.selectorindex is not None:
+                    if not self.selectorindex.search(objname):
+                        continue
                 klass = ROOT.TClass.GetClass(classname)
                 if not (klass.InheritsFrom('TH1')
                         or klass.InheritsFrom('TGraph')
                         or klass.InheritsFrom('TEfficiency')):
                     self._classwarning(k, classname, log)
                     continue
-                objname = os.path.join(dirname, k.GetName())
-                if self.selectors is not None:
-                    if not any(_.fullmatch(objname) for _ in self.selectors):
+                if catalog is not None:
+                    catalog.append(CatalogEntry(objname, dirname, k.GetName(),
+                                                classname, k.GetCycle()))
+                if onlychanged:
+                    # only look at the latest cycle, which is listed first
+                    if objname in seen:
+                        continue
+                    seen.add(objname)
+                    if self.signatures.get(objname, (None,))[0] == _signature(k):
                         continue
-                obj = readobj(k, dryrun)
+                if lazy:
+                    self._remember(objname, k, None)
+                    yield HistObject(objname, ROOTKeyLoader(self, dirname, k.GetName(), k.GetCycle()))
+                    continue
+                obj = self._read(k) if not dryrun else None
+                if not dryrun and not self._remember(objname, k, obj) and onlychanged:
+                    continue
                 log.debug('ROOT input read '
                           f'{os.path.join(dirname, k.GetName())}')
                 yield HistObject(os.path.join(dirname, k.GetName()), obj)
-        infile.Close()
+        if not lazy:
+            infile.Close()
+
+    def readcatalog(self) -> Generator[HistObject, None, None]:
+        """ Read the keys found by warmup() without walking the file again """
+        ROOT = _import_root(self.threads)
+        import os.path
+        log = logging.getLogger(__name__)
+        infile = self._open() if self.lazy else ROOT.TFile.Open(self.source)  # failure to open will raise OSError
+        dirs = {}
+        for entry in self.catalog:
+            with Loader.lock:
+                indir = dirs.get(entry.dirname)
+                if indir is None:
+                    indir = dirs[entry.dirname] = infile.GetDirectory(os.path.join(self.prefix, entry.dirname))
+                k = _getkey(indir, entry.keyname, entry.cycle)
+            if not k:
+                log.warning(f'ROOT input: {entry.name} disappeared since warmup')
+                continue
+            if self.lazy:
+                self._remember(entry.name, k, None)
+                yield HistObject(entry.name, ROOTKeyLoader(self, entry.dirname, entry.keyname, entry.cycle))
+                continue
+            obj = self._read(k)
+            self._remember(entry.name, k, obj)
+            log.debug(f'ROOT input read {entry.name}')
+            yield HistObject(entry.name, obj)
+        if not self.lazy:
+            infile.Close()
+
+    def _read(self, k) -> Any:
+        """ readobj(), counting objects, bytes and time """
+        import time
+        start = time.perf_counter()
+        with trace.span('ReadObj', 'read', key=k.GetName()):
+            obj = readobj(k, False)
+        self.readtime += time.perf_counter() - start
+        self.nread += 1
+        self.nbytes += k.GetNbytes()
+        return obj
+
+    def statistics(self) -> Mapping[str, Any]:
+        """ Keys listed; objects read, their size on disk in bytes and the time taken """
+        return {'keys_listed': self.nkeys, 'objects_read': self.nread,
+                'bytes_read': self.nbytes, 'read_seconds': self.readtime}
+
+    def _open(self) -> Any:
+        """ Open the source for a lazy pass, replacing the handle of the previous one """
+        ROOT = _import_root(self.threads)
+        self.close()
+        self.infile = ROOT.TFile.Open(self.source)  # failure to open will raise OSError
+        return self.infile
+
+    def close(self) -> None:
+        """ Close the file kept open for lazily read histograms """
+        if self.infile is not None:
+            self.infile.Close()
+            self.infile = None
+
+    def _remember(self, name: str, key, obj) -> bool:
+        """ Record the signature of a read key; False if its content is unchanged """
+        digest = content_hash(obj) if self.checksum else None
+        previous = self.signatures.get(name)
+        self.signatures[name] = (_signature(key), digest)
+        return digest is None or previous is None or previous[1] != digest
 
     def _classwarning(self, key, classname, log) -> None:
         """ Log warning for unhandled class """
@@ -87,15 +274,53 @@ class ROOTInputModule(InputModule):
                         "will be suppressed")
 
     def __iter__(self) -> Iterable[HistObject]:
+        if self.catalog is not None:
+            return self.readcatalog()
         return self.iterate(dryrun=False)
 
+    def rescan(self) -> Iterable[HistObject]:
+        """ Walk the file again; return histograms whose key or content changed """
+        return self.iterate(dryrun=False, onlychanged=True)
+
+    def checkpoint(self) -> Any:
+        """ Signatures of the keys read, so that rescan() skips them after a restart """
+        return {'source': self.source, 'signatures': self.signatures}
+
+    def restore(self, state: Any) -> None:
+        log = logging.getLogger(__name__)
+        if state is None or state.get('source') != self.source:
+            log.warning('ROOT input: checkpoint is for a different source; everything will be read')
+            return
+        self.signatures = dict(state['signatures'])
+
     def warmup(self) -> Iterable[HistObject]:
-        return self.iterate(dryrun=True)
+        """ Iterate without reading, recording the selected keys for later iteration """
+        catalog = []
+        yield from self.iterate(dryrun=True, catalog=catalog)
+        self.catalog = catalog
+
+
+def _estimate_size(hist: Any) -> int:
+    """ Rough in-memory size in bytes of the bin storage of a histogram """
+    if hasattr(hist, 'GetNcells'):
+        return 8 * (hist.GetNcells() + hist.GetSumw2N())
+    return 0
 
 
 class ROOTOutputModule(OutputModule):
     def __init__(self):
         self.target = None
+        self.outfile = None
+        self.dircache = {}
+        self.nopens = 0
+        self.nwritten = 0
+        self.writetime = 0.
+        # content hash of the version last written under each name
+        self.written: Dict[str, str] = {}
+        # versions replaced by a later one before being written
+        self.ncoalesced = 0
+        # writes skipped because the content had not changed
+        self.nunchanged = 0
 
     def configure(self, options: Mapping[str, Any]) -> None:
         """
@@ -106,7 +331,20 @@ class ROOTOutputModule(OutputModule):
         overwrite: boolean to indicate whether results should overwrite
             existing histograms in the file.
         delay: only write histograms in finalize() (not during publish()).
+        persistent: keep the target open between writes, and write queued
+            histograms when one of the flush thresholds below is reached.
+        flush_count: (persistent) number of queued histograms which
+            triggers a write. Default 100.
+        flush_bytes: (persistent) estimated size of queued histograms
+            which triggers a write. Default 50 MB.
+        flush_interval: (persistent) seconds since the last write after
+            which a publish, or a call of poll(), triggers a write.
+            Default 10.
+        skip_unchanged: don't write a histogram whose content is the same
+            as the version last written under its name. Default False.
+        threads: other threads may do ROOT I/O at the same time.
         """
+        import time
         if 'target' not in options:
             raise ValueError("Must specify 'target' as an option "
                              "to ROOTOutputModule")
@@ -114,46 +352,163 @@ class ROOTOutputModule(OutputModule):
         self.overwrite = bool(options.get('overwrite', True))
         self.prefix = options.get('prefix', '/')
         self.delay = bool(options.get('delay', False))
-        self.queue = set()
+        self.persistent = bool(options.get('persistent', False))
+        self.flush_count = int(options.get('flush_count') or 100)
+        self.flush_bytes = int(options.get('flush_bytes') or 50_000_000)
+        self.flush_interval = float(options.get('flush_interval') or 10.)
+        self.threads = bool(options.get('threads', False))
+        self.skip_unchanged = bool(options.get('skip_unchanged', False))
+        # queued histograms by name: only the latest version of each is written
+        self.queue: Dict[str, HistObject] = {}
+        self.pending: Dict[str, HistObject] = {}
+        self.pendingbytes = 0
+        self.lastflush = time.monotonic()
+        if self.persistent:
+            import atexit
+            atexit.register(self.close)
 
     def publish(self, obj: Union[HistObject, Iterable[HistObject]]) -> None:
         """ Accepts a HistObject containing a ROOT object to write to file """
+        import time
         if isinstance(obj, HistObject):
             obj = [obj]
         if self.delay:
-            self.queue.update(obj)
+            for o in obj:
+                self.ncoalesced += o.name in self.queue
+                self.queue[o.name] = o
+        elif self.persistent:
+            for o in obj:
+                prev = self.pending.get(o.name)
+                if prev is not None:
+                    self.ncoalesced += 1
+                    self.pendingbytes -= _estimate_size(prev.hist)
+                self.pending[o.name] = o
+                self.pendingbytes += _estimate_size(o.hist)
+            if (len(self.pending) >= self.flush_count
+                    or self.pendingbytes >= self.flush_bytes
+                    or time.monotonic() - self.lastflush >= self.flush_interval):
+                self._flush()
         else:
-            self.queue = obj
+            self.queue = {o.name: o for o in obj}
             self._write()
-            self.queue = None
+            self.queue = {}
+
+    def _open(self) -> Any:
+        import ROOT
+        if self.threads:
+            _enable_threads(ROOT)
+        if self.outfile is None:
+            self.outfile = ROOT.TFile.Open(self.target, 'UPDATE')
+            self.dircache = {}
+            self.nopens += 1
+        return self.outfile
 
     def _write(self) -> None:
         """ Open ROOT file; write obj; close ROOT file """
-        import ROOT
-        import os.path
         if not self.queue:
             return  # Nothing to do
+        with trace.span('write', 'write', objects=len(self.queue)):
+            self._writeobjects(self.queue.values())
+            if not self.persistent:
+                self.close()
+
+    def _flush(self) -> None:
+        """ Write the histograms queued in persistent mode """
+        import time
+        if self.pending:
+            with trace.span('flush', 'write', objects=len(self.pending)):
+                self._writeobjects(self.pending.values())
+                # nothing is opened if every queued histogram was unchanged
+                if self.outfile is not None:
+                    self.outfile.Flush()
+        self.pending = {}
+        self.pendingbytes = 0
+        self.lastflush = time.monotonic()
+
+    def _writeobjects(self, objs: Iterable[HistObject]) -> None:
+        import ROOT
+        import os.path
+        import time
         log = logging.getLogger(__name__)
-        outfile = ROOT.TFile.Open(self.target, 'UPDATE')
-        for o in self.queue:
+        start = time.perf_counter()
+        todo = []
+        for o in objs:
+            digest = None
+            if self.skip_unchanged and isinstance(o.hist, ROOT.TObject):
+                digest = content_hash(o.hist)
+                if self.written.get(o.name) == digest:
+                    log.debug(f"ROOT output: {o.name} is unchanged")
+                    self.nunchanged += 1
+                    continue
+            todo.append((o, digest))
+        if not todo:
+            self.writetime += time.perf_counter() - start
+            return
+        outfile = self._open()
+        for o, digest in todo:
             log.debug(f"ROOT output: publishing {o}")
             fulltargetname = os.path.join(self.prefix, o.name)
             dirtargetname = os.path.dirname(fulltargetname)
             if isinstance(o.hist, ROOT.TObject):
-                if not outfile.GetDirectory(dirtargetname):
-                    outfile.mkdir(dirtargetname if dirtargetname[0] != '/'
-                                  else dirtargetname[1:])
-                d = outfile.GetDirectory(dirtargetname)
+                d = self.dircache.get(dirtargetname)
+                if d is None:
+                    if not outfile.GetDirectory(dirtargetname):
+                        outfile.mkdir(dirtargetname if dirtargetname[0] != '/'
+                                      else dirtargetname[1:])
+                    d = self.dircache[dirtargetname] = outfile.GetDirectory(dirtargetname)
                 d.WriteTObject(o.hist, os.path.basename(fulltargetname),
                                "WriteDelete" if self.overwrite else "")
+                self.nwritten += 1
+                if digest is not None:
+                    self.written[o.name] = digest
             else:
                 log.error("ROOT output: unsupported object type "
                           f"{type(o.hist).__name__}")
-        outfile.Close()
+        self.writetime += time.perf_counter() - start
+
+    def poll(self) -> None:
+        """ In persistent mode, write queued histograms once flush_interval has passed """
+        import time
+        if self.pending and time.monotonic() - self.lastflush >= self.flush_interval:
+            self._flush()
+
+    def flush(self) -> None:
+        """ Write the histograms queued by delay or persistent mode now """
+        if self.delay:
+            self._write()
+            self.queue = {}
+        if self.pending:
+            self._flush()
+
+    def close(self) -> None:
+        """ Write anything queued in persistent mode and close the file """
+        if self.pending:
+            self._flush()
+        if self.outfile is not None:
+            self.outfile.Close()
+            self.outfile = None
+            self.dircache = {}
+
+    def statistics(self) -> Mapping[str, Any]:
+        """ Objects written, file opens, time spent writing and writes saved """
+        return {'objects_written': self.nwritten, 'opens': self.nopens,
+                'write_seconds': self.writetime, 'coalesced': self.ncoalesced,
+                'unchanged_skipped': self.nunchanged}
+
+    def report(self) -> None:
+        """ Log write statistics """
+        log = logging.getLogger(__name__)
+        rate = self.nwritten / self.writetime if self.writetime else 0.
+        log.info(f"ROOT output: wrote {self.nwritten} objects in {self.writetime:.2f} s "
+                 f"({rate:.1f}/s) with {self.nopens} file opens; {self.ncoalesced + self.nunchanged} writes "
+                 f"saved ({self.ncoalesced} superseded before writing, {self.nunchanged} unchanged)")
 
     def finalize(self) -> None:
         """ Writes outstanding HistObjects to file """
         self._write()
+        self.queue = {}
+        self.close()
+        self.report()
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -0,0 +1,90 @@
+# Zero-copy NumPy views of the storage of ROOT histograms
+from typing import Any, Optional
+
+# element type of the TArray base of each histogram class
+_DTYPES = [('TArrayD', 'f8'), ('TArrayF', 'f4'), ('TArrayI', 'i4'),
+           ('TArrayL64', 'i8'), ('TArrayS', 'i2'), ('TArrayC', 'i1')]
+
+
+def _dtype(hist: Any) -> str:
+    for klass, dtype in _DTYPES:
+        if hist.InheritsFrom(klass):
+            return dtype
+    raise TypeError(f'{type(hist).__name__} does not have array storage')
+
+
+def _shape(hist: Any):
+    """ Storage shape in ROOT order (z, y, x), including under/overflow bins """
+    dim = hist.GetDimension()
+    shape = [hist.GetNbinsX() + 2]
+    if dim > 1:
+        shape.insert(0, hist.GetNbinsY() + 2)
+    if dim > 2:
+        shape.insert(0, hist.GetNbinsZ() + 2)
+    return tuple(shape)
+
+
+def _view(buffer: Any, dtype: str, shape) -> Any:
+    import numpy as np
+    n = int(np.prod(shape))
+    buffer.reshape((n,))
+    # transpose so that indices run (x, y, z) like GetBinContent
+    return np.frombuffer(buffer, dtype=dtype, count=n).reshape(shape).T
+
+
+def contents(hist: Any) -> Any:
+    """
+    Bin contents of a TH1/TH2/TH3, including under/overflow, as a writable
+    array sharing memory with the histogram, indexed [x] / [x, y] / [x, y, z]
+    with the same bin numbers as GetBinContent.
+    """
+    return _view(hist.GetArray(), _dtype(hist), _shape(hist))
+
+
+def sumw2(hist: Any) -> Optional[Any]:
+    """ Sum of squared weights, like contents(); None if not allocated """
+    if not hist.GetSumw2N():
+        return None
+    return _view(hist.GetSumw2().GetArray(), 'f8', _shape(hist))
+
+
+def errors2(hist: Any) -> Any:
+    """ Squared bin errors: sumw2 if allocated, otherwise the contents (Poisson) """
+    rv = sumw2(hist)
+    if rv is None:
+        rv = contents(hist).astype('f8')
+    return rv
+
+
+def edges(hist: Any, axis: str = 'x') -> Any:
+    """ Bin edges along an axis (nbins + 1 values; a view for variable binning) """
+    import numpy as np
+    ax = {'x': hist.GetXaxis, 'y': hist.GetYaxis, 'z': hist.GetZaxis}[axis]()
+    nbins = ax.GetNbins()
+    xbins = ax.GetXbins()
+    if xbins.GetSize():
+        return _view(xbins.GetArray(), 'f8', (nbins + 1,))
+    return np.linspace(ax.GetXmin(), ax.GetXmax(), nbins + 1)
+
+
+def centers(hist: Any, axis: str = 'x') -> Any:
+    """ Bin centres along an axis, with the under/overflow bins at the outer edges """
+    import numpy as np
+    e = edges(hist, axis)
+    return np.concatenate(([e[0]], (e[1:] + e[:-1]) / 2, [e[-1]]))
+
+
+def flat(hist: Any) -> Any:
+    """ Bin contents in storage order (indexed by global bin number), as a view """
+    import numpy as np
+    return _view(hist.GetArray(), _dtype(hist), (int(np.prod(_shape(hist))),))
+
+
+def from_flat(template: Any, values: Any) -> Any:
+    """ New histogram binned like template, with contents from a storage-order array """
+    rv = template.Clone()
+    rv.Reset()
+    rv.Sumw2(False)
+    flat(rv)[...] = values
+    rv.ResetStats()
+    return rv
@@ -0,0 +1,59 @@
+# Releasing input histograms once they are no longer needed
+from typing import Dict, List, Sequence, Set, Tuple
+import logging
+
+
+def peak_rss() -> int:
+    """ Peak resident memory of this process in bytes (0 if unknown) """
+    try:
+        import resource
+        import sys
+    except ImportError:  # pragma: no cover
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class EvictionTracker(object):
+    """
+    Reference counting of input histograms across transformers. Using the
+    catalogs built by Transformer.catalog(), count for each input name the
+    output groups it contributes to; once all of them have been transformed,
+    drop the histogram from every transformer holding it.
+    """
+    def __init__(self, transformers: Sequence):
+        self.remaining: Dict[str, int] = {}
+        self.holders: Dict[str, List[Tuple[object, int, Tuple[str]]]] = {}
+        self.fired: Set[Tuple[int, Tuple[str]]] = set()
+        self.nevicted = 0
+        for t in transformers:
+            if t.contributes is None:
+                t.catalog()
+            for (slot, tup), keys in t.contributes.items():
+                name = t.hits[slot][tup].name
+                self.remaining[name] = self.remaining.get(name, 0) + len(keys)
+                self.holders.setdefault(name, []).append((t, slot, tup))
+            t.onfire = self.onfire
+
+    def onfire(self, t, key: Tuple[str]) -> None:
+        if (id(t), key) in self.fired:
+            return
+        self.fired.add((id(t), key))
+        for slot, tup in t.members.get(key, ()):
+            name = t.hits[slot][tup].name
+            self.remaining[name] -= 1
+            if not self.remaining[name]:
+                self.evict(name)
+
+    def evict(self, name: str) -> None:
+        log = logging.getLogger(__name__)
+        log.debug(f'Evicting {name}')
+        for t, slot, tup in self.holders[name]:
+            t.evict(slot, tup)
+        self.nevicted += 1
+
+    def report(self) -> None:
+        log = logging.getLogger(__name__)
+        log.info(f'Evicted {self.nevicted} of {len(self.remaining)} input histograms; '
+                 f'peak memory {peak_rss() / 2**20:.1f} MB')
@@ -0,0 +1,206 @@
+# Regular expression analysis and indexing utilities
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Tuple, Match
+import re
+
+try:
+    from re import _parser as _sre_parse, _constants as _sre_constants
+except ImportError:  # pragma: no cover (Python < 3.11)
+    import sre_parse as _sre_parse
+    import sre_constants as _sre_constants
+
+
+def literal_prefix(regex: Pattern) -> Tuple[str, bool]:
+    """
+    Return the literal string any full match of regex must start with, and
+    whether the pattern is entirely literal (i.e. matches only that string).
+    """
+    if regex.flags & ~re.UNICODE:
+        # case-insensitive matching and friends break the literal analysis
+        return '', False
+    parsed = _sre_parse.parse(regex.pattern)
+    prefix = []
+    for op, av in parsed:
+        if op is not _sre_constants.LITERAL:
+            return ''.join(prefix), False
+        prefix.append(chr(av))
+    return ''.join(prefix), True
+
+
+def anonymize_groups(pattern: str) -> Optional[str]:
+    """
+    Turn the named groups of pattern into non-capturing groups, so that
+    several patterns can be joined into one alternation. Returns None if
+    this can't be done safely (backreferences, conditionals, inline flags).
+    """
+    out = []
+    i, n = 0, len(pattern)
+    inclass = False
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            if not inclass and pattern[i+1:i+2].isdigit():
+                return None
+            out.append(pattern[i:i+2])
+            i += 2
+            continue
+        if inclass:
+            if c == ']':
+                inclass = False
+            out.append(c)
+            i += 1
+            continue
+        if c == '[':
+            inclass = True
+            out.append(c)
+            i += 1
+            # a ']' right after '[' or '[^' is a literal
+            if pattern.startswith('^', i):
+                out.append('^')
+                i += 1
+            if pattern.startswith(']', i):
+                out.append(']')
+                i += 1
+            continue
+        if pattern.startswith('(?P<', i):
+            out.append('(?:')
+            i = pattern.index('>', i) + 1
+            continue
+        if (pattern.startswith('(?P=', i) or pattern.startswith('(?(', i)
+                or re.match(r'\(\?[aiLmsux]', pattern[i:i+3])):
+            return None
+        out.append(c)
+        i += 1
+    rv = ''.join(out)
+    try:
+        re.compile(rv)
+    except re.error:
+        return None
+    return rv
+
+
+class _Bucket(object):
+    """ Patterns sharing a literal prefix, with an optional combined prefilter """
+    def __init__(self):
+        self.indices: List[int] = []
+        self.screened: List[int] = []
+        self.unscreened: List[int] = []
+        self.prefilter: Optional[Pattern] = None
+
+    def build(self, regexes: List[Pattern]) -> None:
+        alternatives = []
+        for idx in self.indices:
+            anon = (anonymize_groups(regexes[idx].pattern)
+                    if not regexes[idx].flags & ~re.UNICODE else None)
+            if anon is None:
+                self.unscreened.append(idx)
+            else:
+                self.screened.append(idx)
+                alternatives.append(f'(?:{anon})')
+        if len(alternatives) > 1:
+            self.prefilter = re.compile('|'.join(alternatives))
+        else:
+            self.unscreened = self.indices
+            self.screened = []
+
+    def candidates(self, name: str) -> List[int]:
+        if self.prefilter is None:
+            return self.indices
+        if self.prefilter.fullmatch(name):
+            return self.indices
+        return self.unscreened
+
+
+class PatternIndex(object):
+    """
+    Find all of a collection of regular expressions that fully match a name,
+    without testing every expression against every name.
+
+    Fully literal patterns are found with a dictionary lookup. The others are
+    bucketed by their literal prefix (one hash table per prefix length, so a
+    lookup costs one probe per distinct length); the patterns within a bucket
+    are joined into one alternation which screens out names that none of
+    them can match before the individual expressions are tried.
+    """
+    def __init__(self, entries: Iterable[Tuple[Pattern, Any]]):
+        self.regexes: List[Pattern] = []
+        self.payloads: List[Any] = []
+        self.literals: Dict[str, List[int]] = {}
+        self.prefixes: Dict[int, Dict[str, _Bucket]] = {}
+        # number of times each pattern has been tested against a name
+        self.ntests: List[int] = []
+        for regex, payload in entries:
+            idx = len(self.regexes)
+            self.regexes.append(regex)
+            self.payloads.append(payload)
+            self.ntests.append(0)
+            prefix, isliteral = literal_prefix(regex)
+            if isliteral:
+                self.literals.setdefault(prefix, []).append(idx)
+            else:
+                bucket = self.prefixes.setdefault(len(prefix), {}).setdefault(prefix, _Bucket())
+                bucket.indices.append(idx)
+        for buckets in self.prefixes.values():
+            for bucket in buckets.values():
+                bucket.build(self.regexes)
+        self.lengths = sorted(self.prefixes)
+
+    def __len__(self):
+        return len(self.regexes)
+
+    def candidates(self, name: str) -> List[int]:
+        """ Indices of the patterns which may match name, in insertion order """
+        rv = list(self.literals.get(name, ()))
+        namelen = len(name)
+        for length in self.lengths:
+            if length > namelen:
+                break
+            bucket = self.prefixes[length].get(name[:length])
+            if bucket is not None:
+                rv.extend(bucket.candidates(name))
+        rv.sort()
+        return rv
+
+    def match(self, name: str) -> List[Tuple[Any, Match]]:
+        """ (payload, match) for every pattern which fully matches name """
+        rv = []
+        for idx in self.candidates(name):
+            self.ntests[idx] += 1
+            m = self.regexes[idx].fullmatch(name)
+            if m:
+                rv.append((self.payloads[idx], m))
+        return rv
+
+    def search(self, name: str) -> bool:
+        """ Whether any pattern fully matches name """
+        for idx in self.candidates(name):
+            self.ntests[idx] += 1
+            if self.regexes[idx].fullmatch(name):
+                return True
+        return False
+
+
+class PrefixFilter(object):
+    """
+    Decide, from the literal prefixes of a collection of patterns, whether a
+    name beneath a given directory ('/'-separated) could match any of them.
+    """
+    def __init__(self, regexes: Iterable[Pattern]):
+        prefixes = {literal_prefix(_)[0] for _ in regexes}
+        # a pattern without a literal prefix can be anywhere
+        self.everything = '' in prefixes
+        # directories on the way to a prefix
+        self.ancestors = set()
+        # prefixes by length
+        self.bylength: Dict[int, set] = {}
+        for prefix in prefixes:
+            for i, c in enumerate(prefix):
+                if c == '/':
+                    self.ancestors.add(prefix[:i])
+            self.bylength.setdefault(len(prefix), set()).add(prefix)
+
+    def __call__(self, dirname: str) -> bool:
+        if self.everything or dirname in self.ancestors:
+            return True
+        path = dirname + '/'
+        return any(path[:length] in prefixes for length, prefixes in self.bylength.items()
+                   if length <= len(path))
@@ -0,0 +1,114 @@
+# Event loop with reading, transforming and publishing in separate threads
+from typing import Any, Callable, List, Optional
+import logging
+import queue
+import threading
+
+# marks the end of a stream of items
+_END = object()
+
+
+class _Stages(object):
+    """
+    Bounded queues between the stages of the pipeline, and the shared stop
+    flag. Once any stage fails (or the job is interrupted), the first error
+    is kept, every stage stops at its next queue operation, and the error
+    is re-raised by the main thread.
+    """
+    def __init__(self, queuesize: int):
+        self.reads: queue.Queue = queue.Queue(maxsize=queuesize)
+        self.writes: queue.Queue = queue.Queue(maxsize=queuesize)
+        self.stop = threading.Event()
+        self.errors: List[BaseException] = []
+
+    def fail(self, error: BaseException) -> None:
+        self.errors.append(error)
+        self.stop.set()
+
+    def put(self, q: queue.Queue, item: Any) -> bool:
+        """ Put item on q, waiting while it is full; False if the pipeline is stopping """
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, q: queue.Queue, idle: Optional[Callable[[], None]] = None) -> Any:
+        """ Next item of q; _END if the pipeline is stopping. idle() is called while q is empty """
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if idle is not None:
+                    idle()
+        return _END
+
+    def thread(self, target: Callable[[], None], name: str) -> threading.Thread:
+        def run():
+            try:
+                target()
+            except BaseException as e:
+                self.fail(e)
+        rv = threading.Thread(target=run, name=name, daemon=True)
+        rv.start()
+        return rv
+
+
+def pipelined_eventloop(im, om, transformers, args, log, dispatcher, executor, chain=None,
+                        inputs=None) -> None:
+    """
+    Same as engine.eventloop, but inputs are read by one thread and outputs
+    published by another, connected to the transforming (calling) thread by
+    queues of args.queue_size items. Inputs are transformed, and outputs
+    published, in the same order as by engine.eventloop.
+    """
+    from .engine import process, process_end
+    stages = _Stages(getattr(args, 'queue_size', None) or 100)
+    source = im if inputs is None else inputs
+
+    def read():
+        for obj in source:
+            if not stages.put(stages.reads, obj):
+                return
+        stages.put(stages.reads, _END)
+
+    def write():
+        while True:
+            # queued outputs are written on time even when none are coming
+            v = stages.get(stages.writes, idle=om.poll)
+            if v is _END:
+                return
+            om.publish(v)
+
+    reader = stages.thread(read, 'histgrinder-read')
+    writer = stages.thread(write, 'histgrinder-write')
+    try:
+        while True:
+            obj = stages.get(stages.reads)
+            if obj is _END:
+                break
+            v = process(obj, dispatcher, executor, chain, args)
+            if v and not stages.put(stages.writes, v):
+                break
+        if not stages.stop.is_set():
+            v = process_end(transformers, executor, chain, args, log)
+            if v:
+                stages.put(stages.writes, v)
+        stages.put(stages.writes, _END)
+        writer.join()
+    except BaseException as e:
+        stages.fail(e)
+    finally:
+        stages.stop.set()
+        writer.join()
+        # the reader may be blocked inside the input module; don't wait for ever
+        reader.join(timeout=10)
+        if reader.is_alive():
+            logging.getLogger(__name__).warning('Input thread did not stop')
+    if stages.errors:
+        raise stages.errors[0]
+
+    log.info("Finalizing output")
+    om.finalize()
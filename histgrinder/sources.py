@@ -0,0 +1,168 @@
+# Processing of several input sources in one job
+from .interfaces import OutputModule
+from .HistObject import HistObject
+from typing import Any, Dict, Iterable, List, Mapping, Union
+import logging
+
+
+def expand_sources(specs: Iterable[str]) -> List[str]:
+    """
+    Turn command line sources into a list: @FILE is replaced by the lines of
+    FILE (blank lines and lines starting with # are skipped), and glob
+    patterns by the sorted names they match. Anything else (e.g. a URL) is
+    kept as it is.
+    """
+    import glob
+    rv = []
+    for spec in specs:
+        if spec.startswith('@'):
+            with open(spec[1:]) as f:
+                rv.extend(line.strip() for line in f
+                          if line.strip() and not line.lstrip().startswith('#'))
+        elif any(c in spec for c in '*?['):
+            matches = sorted(glob.glob(spec))
+            if not matches:
+                raise ValueError(f'No input sources match {spec}')
+            rv.extend(matches)
+        else:
+            rv.append(spec)
+    return rv
+
+
+def source_labels(sources: List[str]) -> List[str]:
+    """ Short unique names for sources: the file name without extension (numbered if repeated) """
+    import os.path
+    stems = [os.path.splitext(os.path.basename(_.rstrip('/')))[0] or 'source' for _ in sources]
+    rv = []
+    seen: Dict[str, int] = {}
+    for stem in stems:
+        if stems.count(stem) > 1:
+            seen[stem] = seen.get(stem, 0) + 1
+            stem = f'{stem}_{seen[stem]}'
+        rv.append(stem)
+    return rv
+
+
+class CollectingOutputModule(OutputModule):
+    """
+    Keeps published histograms in memory, to be sent to the writer of the
+    job. Only the latest version of each name is kept.
+    """
+    def __init__(self):
+        self.latest: Dict[str, HistObject] = {}
+
+    @property
+    def objects(self) -> List[HistObject]:
+        return list(self.latest.values())
+
+    def configure(self, options: Mapping[str, Any]) -> None:
+        return
+
+    def publish(self, obj: Union[HistObject, Iterable[HistObject]]) -> None:
+        if isinstance(obj, HistObject):
+            obj = [obj]
+        for o in obj:
+            self.latest[o.name] = o
+
+    def finalize(self) -> None:
+        return
+
+    def statistics(self) -> Mapping[str, Any]:
+        return {'objects_collected': len(self.latest)}
+
+
+def process_source(index: int, source: str, label: str, configs: List, args) -> Dict[str, Any]:
+    """
+    Run the transformations on one source. In 'separate' mode, outputs are
+    written to this source's own target; otherwise they are returned, for
+    the writer of the job.
+    """
+    from .config import lookup_name
+    from .engine import input_configuration, output_configuration, warmup, eventloop
+    from .executor import make_executor
+    from .transform import Transformer, Dispatcher
+    log = logging.getLogger(__name__)
+    log.info(f'Processing source {index}: {source}')
+    transformers = [Transformer(_) for _ in configs]
+    im = lookup_name(args.inmodule)()
+    im.configure(input_configuration(args, source))
+    selectors = set()
+    for t in transformers:
+        selectors.update(t.inregexes)
+    im.setSelectors(selectors)
+    if args.merge == 'separate':
+        om = lookup_name(args.outmodule)()
+        om.configure(output_configuration(args, args.target.format(label=label, index=index)))
+    else:
+        om = CollectingOutputModule()
+    dispatcher = Dispatcher(transformers)
+    transformers, dispatcher, chain, tracker, cache = warmup(im, transformers, dispatcher, args, log)
+    # no nested pools in the workers of run_sources()
+    executor = make_executor(args.jobs if args.source_jobs <= 1 else 1, args.executor, args.defer)
+    try:
+        eventloop(im, om, transformers, args, log, dispatcher, executor, chain)
+    finally:
+        executor.shutdown()
+        im.close()
+        if tracker is not None:
+            tracker.report()
+        if cache is not None:
+            cache.report()
+    rv = {'outputs': [] if args.merge == 'separate' else om.objects}
+    if args.stats:
+        from . import stats
+        rv['statistics'] = stats.collect(dispatcher, im, om)
+    return rv
+
+
+def run_sources(sources: List[str], configs: List, args, log) -> None:
+    """
+    Process each source (on args.source_jobs processes), and write the
+    outputs according to args.merge.
+    """
+    merge = args.merge or 'prefix'
+    args.merge = merge
+    labels = source_labels(sources)
+    if merge == 'separate' and args.target.format(label='a', index=0) == args.target.format(label='b', index=1):
+        raise ValueError('With --merge separate, the target must contain {label} or {index}')
+    work = list(zip(range(len(sources)), sources, labels))
+    if args.source_jobs > 1 and len(sources) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        context = (multiprocessing.get_context('fork')
+                   if 'fork' in multiprocessing.get_all_start_methods() else None)
+        with ProcessPoolExecutor(max_workers=min(args.source_jobs, len(sources)), mp_context=context) as pool:
+            futures = [pool.submit(process_source, index, source, label, configs, args)
+                       for index, source, label in work]
+            _write((_.result() for _ in futures), labels, sources, args, log)
+    else:
+        _write((process_source(index, source, label, configs, args) for index, source, label in work),
+               labels, sources, args, log)
+
+
+def _write(results: Iterable[Dict[str, Any]], labels: List[str], sources: List[str], args, log) -> None:
+    """ Publish the outputs of each source, in source order, with the single writer of the job """
+    from .config import lookup_name
+    from .engine import output_configuration
+    merge = args.merge
+    om = None
+    if merge != 'separate':
+        om = lookup_name(args.outmodule)()
+        om.configure(output_configuration(args, args.target))
+    report = {}
+    for label, source, result in zip(labels, sources, results):
+        if om is not None and result['outputs']:
+            if merge == 'prefix':
+                for o in result['outputs']:
+                    o.name = f'{label}/{o.name}'
+            om.publish(result['outputs'])
+        if 'statistics' in result:
+            report[source] = result['statistics']
+    if om is not None:
+        log.info("Finalizing output")
+        om.finalize()
+    if args.stats:
+        from . import stats
+        stats.write({'sources': report, 'output': dict(om.statistics()) if om is not None else {}},
+                    args.stats)
+        log.info(f"Statistics written to {args.stats}")
@@ -0,0 +1,37 @@
+# Job statistics report
+from typing import Any, Dict, Mapping, Optional
+
+
+def collect(dispatcher, im, om, elapsed: Optional[float] = None,
+            startup: Optional[Mapping[str, float]] = None) -> Dict[str, Any]:
+    """ Counters of every transformer and of the input and output modules """
+    rv = {'transformers': dispatcher.statistics(),
+          'input': dict(im.statistics()),
+          'output': dict(om.statistics())}
+    if elapsed is not None:
+        rv['elapsed_seconds'] = elapsed
+    if startup is not None:
+        rv['startup_seconds'] = dict(startup)
+    return rv
+
+
+def format_table(report: Mapping[str, Any]) -> str:
+    """ The report as text, transformers sorted by the time spent in their function """
+    lines = [f"{'description':<30} {'regex tests':>12} {'matches':>9} {'calls':>7} "
+             f"{'function s':>11} {'outputs':>8} {'hits held':>10}"]
+    for t in sorted(report['transformers'], key=lambda _: -_['function_seconds']):
+        lines.append(f"{t['description'][:30]:<30} {t['regex_tests']:>12} {t['matches']:>9} "
+                     f"{t['calls']:>7} {t['function_seconds']:>11.3f} {t['outputs']:>8} "
+                     f"{t['hits_held']:>10}")
+    for module in ('input', 'output'):
+        if report[module]:
+            lines.append(f'{module}: ' + ', '.join(f'{k} {v:.3f}' if isinstance(v, float) else f'{k} {v}'
+                                                   for k, v in report[module].items()))
+    return '\n'.join(lines)
+
+
+def write(report: Mapping[str, Any], filename: str) -> None:
+    """ Write the report as JSON """
+    import json
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=1)
@@ -0,0 +1,103 @@
+# Timeline of a job, written as Chrome trace events
+#
+# Instrumented code wraps what it does in "with trace.span(name, category,
+# **args):". Until enable() is called, span() returns a shared object whose
+# __enter__ and __exit__ do nothing, so tracing costs one function call per
+# span when it is off. The file written by Tracer.write() can be opened in
+# chrome://tracing or https://ui.perfetto.dev.
+from typing import Any, Deque, Dict, Optional
+import collections
+import threading
+import time
+
+# the enabled tracer, if any
+tracer: Optional['Tracer'] = None
+
+# spans kept by default; a job running with --watch keeps the latest ones
+MAXEVENTS = 1000000
+
+
+class _NoSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOSPAN = _NoSpan()
+
+
+class _Span(object):
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, tracer: 'Tracer', name: str, cat: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.name, self.cat, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class Tracer(object):
+    """
+    Collects spans (complete events, with a start time and a duration) from
+    every thread of this process. Spans in other processes (--workers,
+    --source-jobs, the process executor) are not recorded. Only the latest
+    maxevents spans are kept.
+    """
+    def __init__(self, maxevents: Optional[int] = MAXEVENTS):
+        import os
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events: Deque[Dict[str, Any]] = collections.deque(maxlen=maxevents)
+        self.threads: Dict[int, str] = {}
+
+    def add(self, name: str, cat: str, start: float, end: float, args: Dict[str, Any]) -> None:
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        # deque.append is atomic, so threads need no lock
+        self.events.append({'name': name, 'cat': cat, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                            'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6,
+                            'args': args})
+
+    def write(self, filename: str) -> None:
+        """ Write the spans recorded so far as a trace event JSON file """
+        import json
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                     'args': {'name': 'histgrinder'}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                      'args': {'name': name}} for tid, name in list(self.threads.items())]
+        with open(filename, 'w') as f:
+            # group keys are tuples; anything else unusual is written as text
+            json.dump({'traceEvents': metadata + list(self.events), 'displayTimeUnit': 'ms'},
+                      f, default=str)
+
+
+def span(name: str, cat: str, **args: Any) -> Any:
+    """ Context manager recording its duration, if tracing is enabled """
+    if tracer is None:
+        return _NOSPAN
+    return _Span(tracer, name, cat, args)
+
+
+def enable(maxevents: Optional[int] = MAXEVENTS) -> Tracer:
+    """ Start recording spans """
+    global tracer
+    tracer = Tracer(maxevents)
+    return tracer
+
+
+def disable() -> None:
+    global tracer
+    tracer = None
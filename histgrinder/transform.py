@@ -1,14 +1,42 @@
 from .config import TransformationConfiguration, lookup_name
 from .HistObject import HistObject
-from typing import DefaultDict, Mapping, Optional, List, Tuple, Match, Dict
+from .patterns import PatternIndex
+from .batch import HistBatch, batch_outputs
+from . import trace
+from typing import Any, Callable, Mapping, Optional, List, Tuple, Match, Dict, Sequence, Iterable
 import re
 
 
+def _check_function(name: str) -> None:
+    """
+    Check that the module of a transformation function exists, without
+    importing it; if the module is already imported, check the function too
+    """
+    import importlib.util
+    import sys
+    modname, _, attr = name.rpartition('.')
+    if not modname:
+        raise ValueError(f"{name} is not of the form module.function")
+    module = sys.modules.get(modname)
+    if module is None:
+        if importlib.util.find_spec(modname) is None:
+            raise ValueError(f"No module named {modname!r}")
+        return
+    if not callable(getattr(module, attr, None)):
+        raise ValueError(f"{name} does not appear to be callable")
+
+
 class Transformer(object):
     def __init__(self, tc: TransformationConfiguration):
         import string
         self.tc = tc
-        self.matchqueue = set()
+        # the function itself is imported on first use (see transform_function)
+        try:
+            _check_function(tc.function)
+        except Exception as e:
+            raise ValueError(f"Unable to instantiate transformer because: {e}")
+        # pending (group name, value) constraints from new matches, kept in arrival order
+        self.matchqueue: Dict[Tuple[Tuple[str, str], ...], None] = {}
         # the number of histograms needed for a match
         self.inlength = len(tc.input)
         # regexes of input
@@ -29,130 +57,434 @@ class Transformer(object):
             self.outputnames = set().union(*[[_[1] for _ in string.Formatter().parse(output)]
                                              for output in self.tc.output])
 
+        # positions (in the first pattern's group tuple) of the groups that appear in outputs
+        self.outputpositions = [i for i, name in enumerate(self.regextupnames[0])
+                                if name in self.outputnames]
+        self.outputkeynames = tuple(self.regextupnames[0][i] for i in self.outputpositions)
+        # for each slot, the positions in the first pattern's group tuple of that slot's groups:
+        # projecting a first position tuple onto these gives the key of its partner in hits[slot]
+        self.joinpositions = [tuple(self.regextupnames[0].index(name) for name in names)
+                              for names in self.regextupnames]
+
         # one dictionary for each input slot
         self.hits: List[Dict[Tuple[str], HistObject]] = [{} for _ in range(len(self.inregexes))]
-        try:
-            self.transform_function = lookup_name(tc.function)
-            if not callable(self.transform_function):
-                raise ValueError(f"{tc.function} does not appear "
-                                 "to be callable")
-        except Exception as e:
-            raise ValueError(f"Unable to instantiate transformer because: {e}")
+        # secondary index of hits[0]: projection onto outputpositions -> ordered set of tuples
+        self.firstindex: Dict[Tuple[str], Dict[Tuple[str], None]] = {}
+        # expected group membership (see catalog()); None means fire eagerly
+        self.contributes: Optional[Dict[Tuple[int, Tuple[str]], List[Tuple[str]]]] = None
+        # number of expected inputs not yet present, per group
+        self.missing: Dict[Tuple[str], int] = {}
+        # groups which have become complete and should be transformed
+        self.ready: Dict[Tuple[str], None] = {}
+        # groups which received inputs since they were last transformed
+        self.touched: Dict[Tuple[str], None] = {}
+        # incomplete groups to transform with what they have (see fire_incomplete())
+        self.partial: Dict[Tuple[str], None] = {}
+        # expected inputs of each group (see catalog())
+        self.members: Dict[Tuple[str], List[Tuple[int, Tuple[str]]]] = {}
+        # cataloged inputs released by evict() and not received again since
+        self.evicted: Dict[Tuple[int, Tuple[str]], None] = {}
+        # groups outside the catalog (from first position inputs which only
+        # appeared after it was made) using each cataloged partner input
+        self.dependents: Dict[Tuple[int, Tuple[str]], Dict[Tuple[str], None]] = {}
+        # called as onfire(transformer, group key) for each group about to be transformed
+        self.onfire: Optional[Callable[['Transformer', Tuple[str]], None]] = None
+        # optional ResultCache of function results (see histgrinder.cache)
+        self.cache = None
+        # counters for statistics()
+        self.nregextests = 0
+        self.nmatches = 0
+        self.ncalls = 0
+        self.functime = 0.
+        self.noutputs = 0
+        # looked up on first use, so that startup doesn't import every function's module
+        self._function: Optional[Callable] = None
+
+    @property
+    def transform_function(self) -> Callable:
+        """ The transformation function, imported on first access """
+        if self._function is None:
+            try:
+                function = lookup_name(self.tc.function)
+                if not callable(function):
+                    raise ValueError(f"{self.tc.function} does not appear "
+                                     "to be callable")
+            except Exception as e:
+                raise ValueError(f"Unable to instantiate transformer because: {e}")
+            self._function = function
+        return self._function
 
     def consider(self, obj: HistObject, defer: bool = False) -> Optional[List[HistObject]]:
         """ Emit a new plot if we get a full match, otherwise None """
-        import logging
-        log = logging.getLogger(__name__)
-        log.debug(self.tc.description)
-        match = None
-        for ire, regex in enumerate(self.inregexes):
-            imatch = regex.fullmatch(obj.name)
-            if imatch:
-                self.hits[ire][tuple(imatch.groupdict().values())] = obj
-                match = imatch
-        if match is None:
-            return None
+        with trace.span('consider', 'match', input=obj.name, transformation=self.tc.description):
+            matches = []
+            self.nregextests += self.inlength
+            for ire, regex in enumerate(self.inregexes):
+                imatch = regex.fullmatch(obj.name)
+                if imatch:
+                    matches.append((ire, imatch))
+            return self.accept(obj, matches, defer)
 
-        self.matchqueue.add(match)
+    def accept(self, obj: HistObject, matches: Sequence[Tuple[int, Match]],
+               defer: bool = False) -> Optional[List[HistObject]]:
+        """
+        Like consider, but with the (input slot, match) pairs for obj already
+        computed (e.g. by a Dispatcher). Slots must be in increasing order.
+        """
+        if not matches:
+            return None
+        self.nmatches += len(matches)
+        eager = False
+        for ire, imatch in matches:
+            tup = tuple(imatch.groupdict().values())
+            prev = self.hits[ire].get(tup)
+            self.hits[ire][tup] = obj
+            if ire == 0:
+                self.firstindex.setdefault(self._project(tup), {})[tup] = None
+            if self.contributes is None:
+                eager = True
+            elif not self._track(ire, tup, prev, obj):
+                eager = True
+                if ire == 0:
+                    self._depend(tup)
+            else:
+                # an update of a cataloged partner also refires the groups outside the catalog using it
+                for key in self.dependents.get((ire, tup), ()):
+                    self.matchqueue[tuple(zip(self.outputkeynames, key))] = None
+        if eager:
+            match = matches[-1][1]
+            self.matchqueue[tuple((k, v) for k, v in match.groupdict().items()
+                                  if k in self.outputnames)] = None
+        elif not self.ready and not self.matchqueue:
+            # waiting for the rest of the group
+            return None
         if defer:
             return None
         return self.transform()
 
+    def catalog(self) -> None:
+        """
+        Record which inputs each output group expects, from the hits seen so
+        far (normally those of the warmup pass). From then on a group is
+        transformed once, when all its expected inputs are present, instead of
+        being re-examined on every new input. Inputs missing from the catalog
+        (e.g. histograms that only appear after the warmup) still trigger
+        their groups eagerly, as do updates of the cataloged inputs those
+        groups share (see _depend()), and groups whose cataloged inputs never all
+        arrive are transformed at the end of the pass (see fire_incomplete()).
+        """
+        self.contributes = {}
+        self.missing = {}
+        self.ready = {}
+        self.touched = {}
+        self.partial = {}
+        self.members = {}
+        self.evicted = {}
+        self.dependents = {}
+        for key, tuples in self.firstindex.items():
+            members = {}
+            for tup in tuples:
+                members[(0, tup)] = None
+                for idx in range(1, self.inlength):
+                    partner = tuple(tup[i] for i in self.joinpositions[idx])
+                    if partner in self.hits[idx]:
+                        members[(idx, partner)] = None
+            self.missing[key] = sum(1 for slot, tup in members if not self.hits[slot][tup].available)
+            if not self.missing[key]:
+                self.ready[key] = None
+            for member in members:
+                self.contributes.setdefault(member, []).append(key)
+            self.members[key] = list(members)
+        self.matchqueue.clear()
+
+    def _depend(self, tup: Tuple[str]) -> None:
+        """ Record the group of an uncataloged first position tuple as a dependent of its cataloged partners """
+        key = self._project(tup)
+        for idx in range(1, self.inlength):
+            partner = (idx, tuple(tup[i] for i in self.joinpositions[idx]))
+            if partner in self.contributes:
+                self.dependents.setdefault(partner, {})[key] = None
+
+    def fire_incomplete(self) -> bool:
+        """
+        At the end of a pass over the input, queue the cataloged groups which
+        received inputs but are still missing some (e.g. histograms seen in
+        the warmup which never arrived). They are transformed with the input
+        combinations which are complete, as they would be without a catalog.
+        Groups with evicted inputs are left out, as they would be transformed
+        without inputs they have. Returns whether any group was queued.
+        """
+        if self.contributes is None:
+            return False
+        for key in self.touched:
+            if self.missing[key] and not any(_ in self.evicted for _ in self.members[key]):
+                self.partial[key] = None
+        return bool(self.partial)
+
+    def checkpoint(self) -> Dict[str, Any]:
+        """ Picklable matching state: the histograms held (with their contents) and pending matches """
+        return {'hits': [{tup: (obj.name, obj.hist) for tup, obj in slot.items()} for slot in self.hits],
+                'matchqueue': list(self.matchqueue)}
+
+    def restore(self, state: Mapping[str, Any]) -> None:
+        """ Take over the state from checkpoint(), on top of what is already known (e.g. from warmup) """
+        for ire, slot in enumerate(state['hits']):
+            for tup, (name, hist) in slot.items():
+                self.hits[ire][tup] = HistObject(name, hist)
+                if ire == 0:
+                    self.firstindex.setdefault(self._project(tup), {})[tup] = None
+        for constraint in state['matchqueue']:
+            self.matchqueue[constraint] = None
+
+    def evict(self, ire: int, tup: Tuple[str]) -> None:
+        """ Forget the histogram held in slot ire for tup (keeping its place in the catalog) """
+        prev = self.hits[ire].get(tup)
+        if prev is None or not prev.available:
+            return
+        placeholder = HistObject(prev.name, None)
+        self.hits[ire][tup] = placeholder
+        if self.contributes is not None and self._track(ire, tup, prev, placeholder):
+            self.evicted[(ire, tup)] = None
+
+    def _track(self, ire: int, tup: Tuple[str], prev: Optional[HistObject], obj: HistObject) -> bool:
+        """ Update completion counts for a new input; False if it isn't in the catalog """
+        keys = self.contributes.get((ire, tup))
+        if keys is None:
+            return False
+        present = obj.available
+        if present != (prev is not None and prev.available):
+            delta = -1 if present else 1
+            for key in keys:
+                self.missing[key] += delta
+        if present:
+            self.evicted.pop((ire, tup), None)
+            for key in keys:
+                self.touched[key] = None
+                if not self.missing[key]:
+                    self.ready[key] = None
+        return True
+
     def transform(self) -> List[HistObject]:
         # Return value list
         rv = []
+        for hci in self.prepare():
+            key, olist = self.lookup(hci)
+            if olist is None:
+                olist, elapsed = self.timed_call(hci)
+                self.record(elapsed)
+                self.store(key, olist)
+            rv.extend(self.outputs(hci, olist))
+        return rv
+
+    def prepare(self) -> List[Any]:
+        """
+        Collect the valid input combinations of all pending groups, and clear
+        the queues. Returns the units of work for call(): one
+        HistCombinationIterable per group, or a single HistBatch for Batch
+        transformers.
+        """
+        # completed groups (see catalog()), then those touched by eager matches
+        groupkeys = dict(self.ready)
+        groupkeys.update(self.partial)
+        for constraint in self.matchqueue:
+            # Given a match, what groups of first position histograms are relevant?
+            for key in self._getMatchingGroups(constraint):
+                groupkeys[key] = None
+
+        # Group the first position matches by integration variables
+        groupedfirstmatches = self._groupMatches(groupkeys)
 
-        firstmatchset = set()
-        for match in self.matchqueue:
-            # Given a match, what first position histograms are relevant?
-            firstmatches = self._getMatchingFirstHists(match)
-            firstmatchset.add(tuple(firstmatches))
-
-        for firstmatches in firstmatchset:
-            # Group the first position matches by integration variables
-            groupedfirstmatches = self._groupMatches(firstmatches)
-
-            # construct iterables & call functions
-            for tuplist in groupedfirstmatches.values():
-                hci = HistCombinationIterable(self, tuplist)
-                if _fullyvalid(hci):
-                    olist = self.transform_function(hci, **self.tc.parameters)
-                    if self.tc.variable_output:
-                        # olist must be a mapping
-                        if not isinstance(olist, Mapping):
-                            raise ValueError(f'Function {self.tc.function} gave a return value which is not a Mapping '
-                                             f'but VariableOutput functions must do so.')
-                        if any(not isinstance(_, str) for _ in olist.keys()):
-                            raise ValueError(f'Function {self.tc.function} gave a return value Mapping where at least one of '
-                                             f'the keys is not a string.')
-                        itrview = olist.items()
-                    else:
-                        if len(olist) != len(self.tc.output):
-                            raise ValueError(f'Function {self.tc.function} gave {len(olist)} return values '
-                                             f'but the YAML configuration specifies {len(self.tc.output)}.')
-                        itrview = zip(self.tc.output, olist)
-                    for foname, ohist in itrview:
-                        oname = foname.format(**dict(zip(self.regextupnames[0], tuplist[0])))
-                        rv.append(HistObject(oname, ohist))
+        # construct iterables
+        rv = []
+        for key, tuplist in groupedfirstmatches.items():
+            hci = HistCombinationIterable(self, tuplist, key)
+            if key in self.partial:
+                # leave out the combinations which are missing a histogram
+                hci = HistCombinationIterable(self, [tup for tup, o in zip(tuplist, hci._resolve())
+                                                     if o is not None and all(_.available for _ in o[1])],
+                                              key)
+            if _fullyvalid(hci):
+                rv.append(hci)
+                self.touched.pop(key, None)
+                if self.onfire is not None:
+                    self.onfire(self, key)
         self.matchqueue.clear()
+        self.ready.clear()
+        self.partial.clear()
+        if self.tc.batch and rv:
+            return [HistBatch(rv)]
         return rv
 
-    def _getMatchingFirstHists(self, match: Match) -> List[Tuple[str]]:
-        firstmatches = []
-        for tup in self.hits[0]:
-            # does the tuple match in all spots where the pattern name matches, and
-            # where the variable is significant (we would output a different plot)?
-            # make sure we handle the 1-indexing of regex matches
-            if all(tup[self.regexgroups[0][_[0]]-1] == _[1]
-                   for _ in match.groupdict().items()
-                   if _[0] in self.outputnames):
-                firstmatches.append(tup)
-        return firstmatches
-
-    def _groupMatches(self, firstmatches: List[Tuple[str]]) -> DefaultDict[Tuple[str], List[Tuple[str]]]:
-        # group matches by self.outputnames
-        import collections
-        rv = collections.defaultdict(list)
-        for tup in firstmatches:
-            reducedtup = tuple(v for i, v in enumerate(tup)
-                               if self.regextupnames[0][i] in self.outputnames)
-            rv[reducedtup].append(tup)
+    def call(self, hci: Any) -> Any:
+        """ Run the transformation function on one unit of work from prepare() """
+        if isinstance(hci, HistBatch):
+            contents, groups = hci.arrays()
+            return self.transform_function(contents, groups, **self.tc.parameters)
+        return self.transform_function(hci, **self.tc.parameters)
+
+    def timed_call(self, hci: Any) -> Tuple[Any, float]:
+        """ (call(hci), seconds taken) """
+        import time
+        group = hci.group if isinstance(hci, HistCombinationIterable) else f'batch of {len(hci)} groups'
+        with trace.span(self.tc.description, 'transform', group=group):
+            start = time.perf_counter()
+            rv = self.call(hci)
+            return rv, time.perf_counter() - start
+
+    def record(self, elapsed: float) -> None:
+        """ Account for one call of the transformation function """
+        self.ncalls += 1
+        self.functime += elapsed
+
+    def statistics(self) -> Dict[str, Any]:
+        """ Counters for this transformation (regex tests made by a Dispatcher are not included) """
+        return {'description': self.tc.description, 'function': self.tc.function,
+                'regex_tests': self.nregextests, 'matches': self.nmatches,
+                'calls': self.ncalls, 'function_seconds': self.functime,
+                'outputs': self.noutputs,
+                'hits_held': sum(1 for slot in self.hits for _ in slot.values() if _.available)}
+
+    def lookup(self, hci: Any) -> Tuple[Optional[str], Any]:
+        """ (cache key, cached result) for a unit of work; the result is None if it must be computed """
+        if self.cache is None:
+            return None, None
+        key = self.cache.key(self, hci)
+        return key, self.cache.get(key)
+
+    def store(self, key: Optional[str], olist: Any) -> None:
+        """ Remember the result of call() under a key from lookup() """
+        if self.cache is not None and key is not None:
+            self.cache.put(key, olist)
+
+    def outputs(self, hci: Any, olist: Any) -> List[HistObject]:
+        """ Check the return value of the transformation function and name the outputs """
+        if isinstance(hci, HistBatch):
+            rv = batch_outputs(self, hci, olist)
+            self.noutputs += len(rv)
+            return rv
+        if self.tc.variable_output:
+            # olist must be a mapping
+            if not isinstance(olist, Mapping):
+                raise ValueError(f'Function {self.tc.function} gave a return value which is not a Mapping '
+                                 f'but VariableOutput functions must do so.')
+            if any(not isinstance(_, str) for _ in olist.keys()):
+                raise ValueError(f'Function {self.tc.function} gave a return value Mapping where at least one of '
+                                 f'the keys is not a string.')
+            itrview = olist.items()
+        else:
+            if len(olist) != len(self.tc.output):
+                raise ValueError(f'Function {self.tc.function} gave {len(olist)} return values '
+                                 f'but the YAML configuration specifies {len(self.tc.output)}.')
+            itrview = zip(self.tc.output, olist)
+        groupvalues = dict(zip(self.regextupnames[0], hci.tuples[0]))
+        rv = [HistObject(foname.format(**groupvalues), ohist) for foname, ohist in itrview]
+        self.noutputs += len(rv)
+        return rv
+
+    def _project(self, tup: Tuple[str]) -> Tuple[str]:
+        """ Reduce a first position tuple to the groups which appear in the output """
+        return tuple(tup[i] for i in self.outputpositions)
+
+    def _getMatchingGroups(self, constraint: Tuple[Tuple[str, str], ...]) -> List[Tuple[str]]:
+        # which groups of first position histograms agree with the match in all spots
+        # where the variable is significant (we would output a different plot)?
+        if len(constraint) == len(self.outputkeynames):
+            # match fixes every output variable: direct lookup
+            values = dict(constraint)
+            key = tuple(values[_] for _ in self.outputkeynames)
+            return [key] if key in self.firstindex else []
+        positions = [(self.outputkeynames.index(k), v) for k, v in constraint]
+        return [key for key in self.firstindex
+                if all(key[i] == v for i, v in positions)]
+
+    def _groupMatches(self, groupkeys: Iterable[Tuple[str]]) -> Dict[Tuple[str], List[Tuple[str]]]:
+        # first position tuples for each group, from the index
+        return {key: list(self.firstindex[key]) for key in groupkeys}
+
+
+class Dispatcher(object):
+    """
+    Route histograms to the transformers which can accept them. All input
+    patterns of all transformers are indexed once, so each name is only
+    tested against the (transformer, slot) pairs that might match it.
+    """
+    def __init__(self, transformers: Sequence[Transformer]):
+        self.transformers = list(transformers)
+        self.index = PatternIndex((regex, (it, ire))
+                                  for it, t in enumerate(self.transformers)
+                                  for ire, regex in enumerate(t.inregexes))
+
+    def dispatch(self, name: str) -> List[Tuple[Transformer, List[Tuple[int, Match]]]]:
+        """ (transformer, [(slot, match), ...]) for every transformer matching name, in order """
+        rv = []
+        lastit = None
+        for (it, ire), match in self.index.match(name):
+            if it != lastit:
+                rv.append((self.transformers[it], []))
+                lastit = it
+            rv[-1][1].append((ire, match))
+        return rv
+
+    def statistics(self) -> List[Dict[str, Any]]:
+        """ Transformer.statistics() of each transformer, including the regex tests made here """
+        rv = [t.statistics() for t in self.transformers]
+        for (it, _), ntests in zip(self.index.payloads, self.index.ntests):
+            rv[it]['regex_tests'] += ntests
+        return rv
+
+    def consider(self, obj: HistObject, defer: bool = False) -> List[HistObject]:
+        """ Offer obj to every transformer; return all resulting outputs """
+        rv = []
+        with trace.span('consider', 'match', input=obj.name):
+            for t, matches in self.dispatch(obj.name):
+                v = t.accept(obj, matches, defer)
+                if v:
+                    rv.extend(v)
         return rv
 
 
 class HistCombinationIterable(object):
-    def __init__(self, transformer: Transformer, tuples):
+    def __init__(self, transformer: Transformer, tuples, group: Optional[Tuple] = None):
         self.transform = transformer
+        # values of the OutputDOF groups, for tracing
+        self.group = group
         # tuple of matching first-position objects.
         # corresponds to each iteration step.
         self.tuples = tuples
+        # resolved combinations, computed once on first use
+        self._pairs = None
 
     def __iter__(self):
         # logic: every tuple (first position object) should correspond to
         # exactly one histogram in each other slot. Find the full set and
         # yield as a tuple ({matches}, [histograms])
-        for tup in self.tuples:
-            rv = self._getpair(tup)
+        for rv in self._resolve():
             if rv is None:
                 continue
-            yield rv
+            yield (rv[0], [_.hist for _ in rv[1]])
+
+    def _resolve(self):
+        """ ({matches}, [HistObjects]) for each tuple (None if incomplete), computed once """
+        if self._pairs is None:
+            self._pairs = [self._getpair(tup) for tup in self.tuples]
+        return self._pairs
 
     def _getpair(self, tup):
         t = self.transform
-        matchdict = dict(zip(t.regextupnames[0], tup))
-        matchlist = [[tup]]
+        objs = [t.hits[0][tup]]
         for idx in range(1, t.inlength):
-            matchlist.append([])
-            for tup2 in t.hits[idx]:
-                if all(v == tup[t.regexgroups[0][t.regextupnames[idx][i]]-1]  # noqa: E501
-                        for i, v in enumerate(tup2)):
-                    matchlist[-1].append(tup2)
-        if any(not _ for _ in matchlist):
-            return None
-        return (matchdict, [t.hits[i][v[0]].hist for i, v in enumerate(matchlist)])
+            # hash join on the slot's groups
+            obj = t.hits[idx].get(tuple(tup[i] for i in t.joinpositions[idx]))
+            if obj is None:
+                return None
+            objs.append(obj)
+        return (dict(zip(t.regextupnames[0], tup)), objs)
 
     def __getitem__(self, idx):
-        return self._getpair(self.tuples[idx])
+        rv = self._resolve()[idx]
+        if rv is None:
+            return None
+        return (rv[0], [_.hist for _ in rv[1]])
 
     def __len__(self):
         return len(self.tuples)
@@ -160,8 +492,11 @@ class HistCombinationIterable(object):
 
 def _fullyvalid(hci: HistCombinationIterable) -> bool:
     hasany = False  # return false if there are no valid combinations
-    for o in hci:
+    for o in hci._resolve():
+        if o is None:
+            continue
         hasany = True
-        if any(_ is None for _ in o[1]):
+        # check without loading lazily-read histograms
+        if any(not _.available for _ in o[1]):
             return False
     return hasany
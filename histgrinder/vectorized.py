@@ -0,0 +1,107 @@
+# Vectorized versions of the example transformations.
+# These operate on NumPy views of the histogram storage (see
+# histgrinder.io.rootnumpy) and fill one preallocated output histogram,
+# instead of making PyROOT calls for every bin or intermediate histogram.
+
+
+def _ratio(num, den, w2num, w2den, out, w2out):
+    """ num/den (0 where den is 0) into out, with errors propagated into w2out """
+    import numpy as np
+    nonzero = den != 0
+    np.divide(num, den, out=out, where=nonzero)
+    out[~nonzero] = 0
+    if w2out is not None:
+        den2 = den.astype('f8') ** 2
+        np.divide(w2num * den2 + w2den * num.astype('f8') ** 2, den2 ** 2,
+                  out=w2out, where=nonzero)
+        w2out[~nonzero] = 0
+
+
+def ratio(inputs):
+    """ Ratio of two histograms, like histgrinder.example.transform_function_divide_ROOT """
+    from .io.rootnumpy import contents, errors2, sumw2
+    num, den = inputs[0][1]
+    out = num.Clone()
+    if not out.GetSumw2N():
+        out.Sumw2()
+    _ratio(contents(num), contents(den), errors2(num), errors2(den), contents(out), sumw2(out))
+    out.ResetStats()
+    return [out]
+
+
+def sum_of_ratios(inputs):
+    """ Sum over all input pairs of the ratio of the first to the second histogram """
+    import numpy as np
+    from .io.rootnumpy import contents, errors2, sumw2
+    pairs = [_[1] for _ in inputs]
+    out = pairs[0][0].Clone()
+    if not out.GetSumw2N():
+        out.Sumw2()
+    num = np.stack([contents(_[0]) for _ in pairs])
+    den = np.stack([contents(_[1]) for _ in pairs])
+    ratios = np.zeros(num.shape, dtype='f8')
+    w2 = np.zeros(num.shape, dtype='f8')
+    _ratio(num, den, np.stack([errors2(_[0]) for _ in pairs]),
+           np.stack([errors2(_[1]) for _ in pairs]), ratios, w2)
+    contents(out)[...] = ratios.sum(axis=0)
+    sumw2(out)[...] = w2.sum(axis=0)
+    out.ResetStats()
+    return [out]
+
+
+def rms_summary(inputs, nbins=40, xmin=0., xmax=2.):
+    """
+    Histogram of the RMS of each (1D) input, like
+    histgrinder.example.transform_function_rms_ROOT. The RMS is computed from
+    the in-range bin contents rather than from the stored statistics.
+    """
+    import numpy as np
+    import ROOT
+    from .io.rootnumpy import contents, centers
+    plots = [_[1][0] for _ in inputs]
+    x = centers(plots[0])[1:-1]
+    w = np.stack([contents(_)[1:-1] for _ in plots]).astype('f8')
+    sumw = w.sum(axis=1)
+    safe = np.where(sumw != 0, sumw, 1)
+    mean = (w * x).sum(axis=1) / safe
+    rms = np.sqrt(np.maximum((w * x ** 2).sum(axis=1) / safe - mean ** 2, 0))
+    rv = ROOT.TH1F('RMS', 'RMS of gaussians', nbins, xmin, xmax)
+    # bins are [low, high) as in TH1::Fill: index 0 is the underflow and
+    # nbins + 1 the overflow, which also takes a value equal to xmax
+    edges = np.linspace(xmin, xmax, nbins + 1)
+    index = np.searchsorted(edges, rms, side='right')
+    contents(rv)[:] = np.bincount(index, minlength=nbins + 2)
+    rv.ResetStats()
+    rv.SetEntries(len(plots))
+    return [rv]
+
+
+def normalise(inputs, norm=1.):
+    """ Copy of the input scaled so that its in-range integral is norm """
+    import numpy as np
+    from .io.rootnumpy import contents, sumw2
+    out = inputs[0][1][0].Clone()
+    c = contents(out)
+    integral = c[tuple(slice(1, -1) for _ in range(c.ndim))].sum()
+    factor = norm / integral if integral else 0.
+    np.multiply(c, factor, out=c, casting='unsafe')
+    w2 = sumw2(out)
+    if w2 is not None:
+        w2 *= factor ** 2
+    out.ResetStats()
+    return [out]
+
+
+def projection(inputs, axis='x'):
+    """ Projection of a 2D histogram onto one axis, summing all bins of the other """
+    import ROOT
+    from .io.rootnumpy import contents, edges, errors2, sumw2
+    hist = inputs[0][1][0]
+    e = edges(hist, axis)
+    rv = ROOT.TH1D(f'{hist.GetName()}_p{axis}', hist.GetTitle(), len(e) - 1, e)
+    rv.Sumw2()
+    other = 1 if axis == 'x' else 0
+    contents(rv)[...] = contents(hist).sum(axis=other)
+    sumw2(rv)[...] = errors2(hist).sum(axis=other)
+    rv.ResetStats()
+    return [rv]
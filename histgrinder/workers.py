@@ -0,0 +1,207 @@
+# Running the transformations of one source on several worker processes
+from .interfaces import OutputModule
+from .HistObject import HistObject
+from typing import Any, Dict, Iterable, List, Mapping, Sequence, Union
+import logging
+
+
+def partition(transformers: Sequence, names: Iterable[str], nworkers: int) -> List[List[int]]:
+    """
+    Split transformers (by index) between at most nworkers workers. Blocks
+    with the same input regex, or whose regexes match the same input names,
+    are kept on one worker, so each input is read by a single worker. The
+    groups are balanced by the number of inputs they read (plus one per
+    transformer), largest first. Indices are in configuration order.
+    """
+    from .transform import Dispatcher
+    parent = list(range(len(transformers)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    bypattern: Dict[str, int] = {}
+    for i, t in enumerate(transformers):
+        for regex in t.inregexes:
+            union(i, bypattern.setdefault(regex.pattern, i))
+    position = {id(t): i for i, t in enumerate(transformers)}
+    dispatcher = Dispatcher(transformers)
+    # one transformer reading each name; its group is only known at the end
+    readers = []
+    for name in names:
+        users = [position[id(t)] for t, _ in dispatcher.dispatch(name)]
+        for i in users[1:]:
+            union(users[0], i)
+        if users:
+            readers.append(users[0])
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(transformers)):
+        groups.setdefault(find(i), []).append(i)
+    weight = {root: len(members) for root, members in groups.items()}
+    for i in readers:
+        weight[find(i)] += 1
+    workers: List[List[int]] = [[] for _ in range(max(1, nworkers))]
+    load = [0] * len(workers)
+    for root in sorted(groups, key=lambda _: (-weight[_], _)):
+        lightest = load.index(min(load))
+        workers[lightest].extend(groups[root])
+        load[lightest] += weight[root]
+    return [sorted(_) for _ in workers if _]
+
+
+class WorkerOutputModule(OutputModule):
+    """ Sends published histograms from a worker to the writer of the job """
+    def __init__(self, results, index: int):
+        self.results = results
+        self.index = index
+        self.nsent = 0
+
+    def configure(self, options: Mapping[str, Any]) -> None:
+        return
+
+    def publish(self, obj: Union[HistObject, Iterable[HistObject]]) -> None:
+        if isinstance(obj, HistObject):
+            obj = [obj]
+        obj = list(obj)
+        self.nsent += len(obj)
+        self.results.put(('outputs', self.index, obj))
+
+    def finalize(self) -> None:
+        return
+
+    def statistics(self) -> Mapping[str, Any]:
+        return {'objects_sent': self.nsent}
+
+
+def run_worker(index: int, source: str, configs: List, args, results) -> None:
+    """
+    Run the transformations in configs on source, reading only the inputs
+    they select, and send the outputs (then the statistics, or the error)
+    to results.
+    """
+    import signal
+    from .config import lookup_name
+    from .engine import input_configuration, warmup, eventloop
+    from .executor import make_executor
+    from .transform import Transformer, Dispatcher
+    log = logging.getLogger(__name__)
+    # terminate() must stop the worker at once, not run the job's SIGTERM handler
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        transformers = [Transformer(_) for _ in configs]
+        im = lookup_name(args.inmodule)()
+        im.configure(input_configuration(args, source))
+        selectors = set()
+        for t in transformers:
+            selectors.update(t.inregexes)
+        im.setSelectors(selectors)
+        om = WorkerOutputModule(results, index)
+        dispatcher = Dispatcher(transformers)
+        transformers, dispatcher, chain, tracker, cache = warmup(im, transformers, dispatcher, args, log)
+        executor = make_executor(args.jobs, args.executor, args.defer)
+        try:
+            eventloop(im, om, transformers, args, log, dispatcher, executor, chain)
+        finally:
+            executor.shutdown()
+            im.close()
+            if tracker is not None:
+                tracker.report()
+            if cache is not None:
+                cache.report()
+        report = None
+        if args.stats:
+            from . import stats
+            report = stats.collect(dispatcher, im, om)
+        results.put(('done', index, report))
+    except Exception as e:
+        log.exception(f'Worker {index} failed')
+        results.put(('error', index, f'{type(e).__name__}: {e}'))
+
+
+def run_workers(source: str, configs: List, args, log) -> None:
+    """
+    Partition the transformations between args.workers processes, run them
+    on source, and write all their outputs with the single writer of the
+    job, as they arrive.
+    """
+    import multiprocessing
+    import queue
+    from .config import lookup_name
+    from .engine import input_configuration, output_configuration
+    from .transform import Transformer
+    transformers = [Transformer(_) for _ in configs]
+    im = lookup_name(args.inmodule)()
+    im.configure(input_configuration(args, source))
+    selectors = set()
+    for t in transformers:
+        selectors.update(t.inregexes)
+    im.setSelectors(selectors)
+    try:
+        parts = partition(transformers, (_.name for _ in im.warmup()), args.workers)
+    finally:
+        im.close()
+    log.info(f"Running {len(transformers)} transformations on {len(parts)} workers "
+             f"({', '.join(str(len(_)) for _ in parts)} each)")
+
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    results = context.Queue()
+    processes = [context.Process(target=run_worker, name=f'histgrinder-worker-{i}',
+                                 args=(i, source, [configs[_] for _ in part], args, results))
+                 for i, part in enumerate(parts)]
+    for p in processes:
+        p.start()
+
+    om = lookup_name(args.outmodule)()
+    om.configure(output_configuration(args, args.target))
+    running = set(range(len(processes)))
+    reports: Dict[int, Any] = {}
+    errors = []
+    try:
+        while running:
+            try:
+                kind, index, payload = results.get(timeout=1)
+            except queue.Empty:
+                # a worker which exits normally has already sent 'done' or 'error'
+                for i in sorted(running):
+                    if not processes[i].is_alive() and processes[i].exitcode != 0:
+                        errors.append(f'Worker {i} exited with code {processes[i].exitcode}')
+                        running.discard(i)
+                continue
+            if kind == 'outputs':
+                om.publish(payload)
+            elif kind == 'done':
+                reports[index] = payload
+                running.discard(index)
+            else:
+                errors.append(f'Worker {index} failed: {payload}')
+                running.discard(index)
+            if errors:
+                break
+    finally:
+        for i in running:
+            processes[i].terminate()
+        # a worker stopped halfway through a message leaves the queue unreadable,
+        # so it is not drained; a worker waiting for it to be read is killed
+        for p in processes:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.kill()
+                p.join()
+    if errors:
+        raise RuntimeError('; '.join(errors))
+
+    log.info("Finalizing output")
+    om.finalize()
+    if args.stats:
+        from . import stats
+        stats.write({'workers': [reports[_] for _ in sorted(reports)], 'output': dict(om.statistics())},
+                    args.stats)
+        log.info(f"Statistics written to {args.stats}")
@@ -22,6 +22,7 @@ setuptools.setup(
     ],
     python_requires='>=3.6',
     install_requires=['PyYAML>=5'],
+    extras_require={'numpy': ['numpy']},
     tests_requires=['pytest', 'pytest-cov'],
     scripts=['bin/histgrinder']
 )
@@ -29,6 +29,165 @@ def test_rootio():
     inputs = list(rim.iterate(dryrun=True))
     assert len(inputs) == 101
 
+    # warmup records a catalog which the main iteration reads from
+    warm = [_.name for _ in rim.warmup()]
+    assert len(rim.catalog) == 101
+    assert [_.name for _ in rim] == warm
+
+
+def test_rootio_coalesce(tmp_path):
+    ROOT = pytest.importorskip("ROOT")
+    from histgrinder.HistObject import HistObject
+    from histgrinder.io.root import ROOTOutputModule
+
+    def version(value):
+        h = ROOT.TH1F('h', 'h', 4, 0, 4)
+        h.Fill(value)
+        return HistObject('dir/h', h)
+
+    for options in [{'delay': True}, {'persistent': True, 'flush_count': 1000}]:
+        rom = ROOTOutputModule()
+        rom.configure(dict(options, target=str(tmp_path / 'coalesce.root')))
+        for value in (0.5, 1.5, 2.5):
+            rom.publish(version(value))
+        rom.finalize()
+        assert rom.nwritten == 1 and rom.ncoalesced == 2
+        f = ROOT.TFile.Open(str(tmp_path / 'coalesce.root'))
+        assert f.Get('dir/h').GetMean() == pytest.approx(2.5)
+        f.Close()
+
+    rom = ROOTOutputModule()
+    rom.configure({'target': str(tmp_path / 'unchanged.root'), 'skip_unchanged': True})
+    for value in (0.5, 0.5, 1.5, 1.5):
+        rom.publish(version(value))
+    rom.finalize()
+    assert (rom.nwritten, rom.nunchanged) == (2, 2)
+
+    # a later pass (as with --watch) in which nothing changed opens nothing
+    rom = ROOTOutputModule()
+    rom.configure({'target': str(tmp_path / 'unchanged.root'), 'skip_unchanged': True, 'persistent': True})
+    rom.publish(version(0.5))
+    rom.finalize()
+    rom.publish(version(0.5))
+    rom.flush()
+    rom.finalize()
+    assert (rom.nwritten, rom.nunchanged, rom.nopens) == (1, 1, 1)
+
+    rom = ROOTOutputModule()
+    rom.configure({'target': str(tmp_path / 'unchanged.root')})
+    for value in (0.5, 0.5):
+        rom.publish(version(value))
+    rom.finalize()
+    assert (rom.nwritten, rom.nunchanged) == (2, 0)
+
+
+def test_rootio_rescan():
+    ROOT = pytest.importorskip("ROOT")
+    import subprocess
+    from histgrinder.io.root import ROOTInputModule
+    chk = subprocess.run("python -m histgrinder.make_sample_file",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    chk.check_returncode()
+
+    rim = ROOTInputModule()
+    rim.configure({'source': 'example.root', 'prefix': 'prefix', 'checksum': True})
+    assert len(list(rim)) == 101
+    assert list(rim.rescan()) == []
+    f = ROOT.TFile.Open('example.root', 'UPDATE')
+    h = f.Get('prefix/gaussians/gaus_3')
+    h.Fill(0.)
+    f.cd('prefix/gaussians')
+    h.Write('', ROOT.TObject.kOverwrite)
+    # rewritten but identical: new key, same content
+    f.Get('prefix/gaussians/gaus_4').Write('', ROOT.TObject.kOverwrite)
+    f.Close()
+    assert [_.name for _ in rim.rescan()] == ['gaussians/gaus_3']
+
+
+def test_rootio_catalog_new_cycle():
+    ROOT = pytest.importorskip("ROOT")
+    import subprocess
+    from histgrinder.io.root import ROOTInputModule
+    chk = subprocess.run("python -m histgrinder.make_sample_file",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    chk.check_returncode()
+
+    for lazy in (False, True):
+        rim = ROOTInputModule()
+        rim.configure({'source': 'example.root', 'prefix': 'prefix', 'lazy': lazy})
+        assert len(list(rim.warmup())) == 101
+        # rewritten after the warmup: a new cycle replaces the cataloged one
+        f = ROOT.TFile.Open('example.root', 'UPDATE')
+        h = f.Get('prefix/gaussians/gaus_3')
+        h.Fill(0.)
+        entries = h.GetEntries()
+        f.cd('prefix/gaussians')
+        h.Write('', ROOT.TObject.kOverwrite)
+        f.Close()
+        objs = {_.name: _ for _ in rim}
+        assert len(objs) == 101
+        assert objs['gaussians/gaus_3'].hist.GetEntries() == entries
+        rim.close()
+
+
+def test_rootnumpy_views():
+    ROOT = pytest.importorskip("ROOT")
+    pytest.importorskip("numpy")
+    from histgrinder.io.rootnumpy import contents, sumw2, edges
+
+    h = ROOT.TH2F('h2', 'h2', 4, 0, 4, 3, 0, 3)
+    h.Fill(2.5, 0.5)
+    c = contents(h)
+    assert c.shape == (6, 5)
+    assert c[3, 1] == 1 == h.GetBinContent(3, 1)
+    # views share memory with the histogram
+    c[1, 2] = 7
+    assert h.GetBinContent(1, 2) == 7
+    assert sumw2(h) is None
+    assert list(edges(h, 'y')) == [0, 1, 2, 3]
+
+
+def test_vectorized_transforms():
+    ROOT = pytest.importorskip("ROOT")
+    pytest.importorskip("numpy")
+    from histgrinder import vectorized
+
+    h1 = ROOT.TH1D('h1', 'h1', 10, -2, 2)
+    h2 = ROOT.TH1D('h2', 'h2', 10, -2, 2)
+    h1.FillRandom('gaus', 1000)
+    h2.FillRandom('gaus', 1000)
+    out = vectorized.ratio([({}, [h1, h2])])[0]
+    ref = h1.Clone()
+    ref.Divide(h2)
+    for i in range(12):
+        assert out.GetBinContent(i) == pytest.approx(ref.GetBinContent(i))
+        assert out.GetBinError(i) == pytest.approx(ref.GetBinError(i))
+
+    norm = vectorized.normalise([({}, [h1])])[0]
+    assert norm.Integral() == pytest.approx(1)
+
+    h3 = ROOT.TH2D('h3', 'h3', 4, 0, 4, 3, 0, 3)
+    h3.Fill(2.5, 0.5)
+    h3.Fill(2.5, 1.5, 2)
+    px = vectorized.projection([({}, [h3])])[0]
+    assert px.GetBinContent(3) == 3 == h3.ProjectionX().GetBinContent(3)
+
+    # RMS of 0, 1 and exactly xmax (2), which ROOT puts in the overflow
+    plots = []
+    for i, (low, high) in enumerate([(-1, 1), (-1, 3), (-2, 6)]):
+        h = ROOT.TH1D(f'r{i}', f'r{i}', 2, low, high)
+        h.Fill(h.GetBinCenter(1))
+        if i:
+            h.Fill(h.GetBinCenter(2))
+        plots.append(h)
+    rms = vectorized.rms_summary([({}, [_]) for _ in plots])[0]
+    ref = ROOT.TH1F('RMSref', 'RMS of gaussians', 40, 0, 2)
+    for h in plots:
+        ref.Fill(h.GetRMS())
+    assert ref.GetBinContent(41) == 1
+    for i in range(42):
+        assert rms.GetBinContent(i) == ref.GetBinContent(i)
+
 
 def test_badconfig():
     from histgrinder.config import read_configuration
@@ -84,3 +243,747 @@ Description: Test
     """)
     with pytest.raises(ValueError):
         read_configuration(f)
+
+
+def test_literal_prefix():
+    import re
+    from histgrinder.patterns import literal_prefix
+    assert literal_prefix(re.compile('gaussians/gaus_72')) == ('gaussians/gaus_72', True)
+    assert literal_prefix(re.compile(r'gaussians/gaus_(?P<id>\d+)')) == ('gaussians/gaus_', False)
+    assert literal_prefix(re.compile(r'(?i)gaussians/gaus')) == ('', False)
+
+
+def test_anonymize_groups():
+    from histgrinder.patterns import anonymize_groups
+    assert anonymize_groups(r'a/(?P<id0>[23])(?P<id>\d)') == r'a/(?:[23])(?:\d)'
+    assert anonymize_groups(r'a[(?P<x>]b') == r'a[(?P<x>]b'
+    assert anonymize_groups(r'(?P<id>\d)_(?P=id)') is None
+    assert anonymize_groups(r'(a)_\1') is None
+
+
+def test_dispatcher_agrees_with_consider():
+    from histgrinder.config import read_configuration
+    from histgrinder.transform import Transformer, Dispatcher
+    from histgrinder.HistObject import HistObject
+    config = read_configuration('tests/test_functional.yaml')
+    names = [f'gaussians/gaus_{i}' for i in range(100)] + ['gaussians/graph', 'graph', 'gaussians/gaus_x']
+    dispatcher = Dispatcher([Transformer(_) for _ in config])
+    for name in names:
+        expected = []
+        for t in dispatcher.transformers:
+            matches = [(ire, m.groupdict()) for ire, m in enumerate(_.fullmatch(name) for _ in t.inregexes) if m]
+            if matches:
+                expected.append((t, matches))
+        assert [(t, [(ire, m.groupdict()) for ire, m in matches])
+                for t, matches in dispatcher.dispatch(name)] == expected
+    for name in names:
+        dispatcher.consider(HistObject(name, None))
+    assert len(dispatcher.transformers[0].hits[0]) == 20
+    assert len(dispatcher.transformers[3].hits[0]) == 100
+
+
+def summarize(inputs):
+    """ Test transform function: list the (sorted) input histograms """
+    return [sorted(tuple(hists) for _, hists in inputs)]
+
+
+def make_transformer(inputs, outputs, function='tests.test_pieces.summarize', **kwargs):
+    from histgrinder.config import TransformationConfiguration
+    from histgrinder.transform import Transformer
+    return Transformer(TransformationConfiguration(Input=inputs, Output=outputs, Function=function,
+                                                   Description='Test', **kwargs))
+
+
+def test_grouping_index():
+    from histgrinder.HistObject import HistObject
+    t = make_transformer([r'(?P<det>A|B|C)_(?P<thr>hi|lo)', r'(?P<det>A|B|C)_eff'], ['summary_{det}'])
+    names = [f'{d}_{thr}' for d in 'ABC' for thr in ('hi', 'lo')] + [f'{d}_eff' for d in 'ABC']
+    for name in names:
+        t.consider(HistObject(name, None))
+    assert t.firstindex == {(d,): {(d, 'hi'): None, (d, 'lo'): None} for d in 'ABC'}
+    out = []
+    for name in names:
+        out += t.consider(HistObject(name, name))
+    assert [(_.name, _.hist) for _ in out] == [
+        (f'summary_{d}', [(f'{d}_hi', f'{d}_eff'), (f'{d}_lo', f'{d}_eff')]) for d in 'ABC']
+
+    # deferred processing: one call per output group
+    for name in names:
+        t.consider(HistObject(name, name), defer=True)
+    assert sorted(_.name for _ in t.transform()) == ['summary_A', 'summary_B', 'summary_C']
+
+
+def test_hash_join_pairing():
+    from histgrinder.HistObject import HistObject
+    from histgrinder.transform import HistCombinationIterable, _fullyvalid
+    # partner slot lists its groups in a different order from the first pattern
+    t = make_transformer([r'(?P<a>\d)_(?P<b>\d)_(?P<c>\d)', r'ref_(?P<c>\d)_(?P<a>\d)'], ['out'])
+    for name in ['1_2_3', '4_5_6', 'ref_3_1', 'ref_6_4', 'ref_9_9']:
+        t.consider(HistObject(name, name), defer=True)
+    hci = HistCombinationIterable(t, [('1', '2', '3'), ('4', '5', '6')])
+    assert hci[1] == ({'a': '4', 'b': '5', 'c': '6'}, ['4_5_6', 'ref_6_4'])
+    assert list(hci) == [({'a': '1', 'b': '2', 'c': '3'}, ['1_2_3', 'ref_3_1']),
+                         ({'a': '4', 'b': '5', 'c': '6'}, ['4_5_6', 'ref_6_4'])]
+    assert _fullyvalid(hci)
+    # a missing partner drops that combination
+    t.consider(HistObject('7_8_9', '7_8_9'), defer=True)
+    hci = HistCombinationIterable(t, [('7', '8', '9')])
+    assert hci[0] is None and len(hci) == 1
+    assert not _fullyvalid(hci)
+
+
+def test_fire_on_complete():
+    from histgrinder.HistObject import HistObject
+    t = make_transformer([r'gaus_(?P<id>\d+)'], ['gauRMS'], function='tests.test_pieces.count_inputs')
+    names = [f'gaus_{i}' for i in range(10)]
+    for name in names:
+        t.consider(HistObject(name, None))
+    t.catalog()
+    assert t.missing == {(): 10}
+    out = []
+    for name in names:
+        out.append(t.consider(HistObject(name, name)))
+    # called exactly once, when the last input arrives
+    assert out[:-1] == [None] * 9
+    assert [(_.name, _.hist) for _ in out[-1]] == [('gauRMS', 10)]
+    # an input unknown to the warmup is handled eagerly
+    assert [_.hist for _ in t.consider(HistObject('gaus_10', 'gaus_10'))] == [11]
+    # an update of a known input refires the (complete) group
+    assert [_.hist for _ in t.consider(HistObject('gaus_3', 'gaus_3'))] == [11]
+
+
+def test_fire_on_complete_new_group():
+    from histgrinder.HistObject import HistObject
+    t = make_transformer([r'd/(?P<a>\d)_(?P<b>\d)', r'd/x_(?P<a>\d)'], ['x_{b}'])
+    for name in ['d/0_1', 'd/x_0']:
+        t.consider(HistObject(name, None))
+    t.catalog()
+    assert t.consider(HistObject('d/0_1', '0_1')) is None
+    assert [(_.name, _.hist) for _ in t.consider(HistObject('d/x_0', 'x_0#1'))] == [('x_1', [('0_1', 'x_0#1')])]
+    # a group which only appeared after the warmup, using a cataloged partner
+    assert [(_.name, _.hist) for _ in t.consider(HistObject('d/0_0', '0_0'))] == [('x_0', [('0_0', 'x_0#1')])]
+    # an update of the partner refires it as well as the cataloged group
+    assert sorted((_.name, _.hist) for _ in t.consider(HistObject('d/x_0', 'x_0#2'))) == [
+        ('x_0', [('0_0', 'x_0#2')]), ('x_1', [('0_1', 'x_0#2')])]
+
+
+def test_fire_incomplete():
+    import argparse
+    import logging
+    from histgrinder.HistObject import HistObject
+    from histgrinder.engine import eventloop
+    from histgrinder.sources import CollectingOutputModule
+    t = make_transformer([r'(?P<det>A|B)_(?P<id>\d)', r'(?P<det>A|B)_ref(?P<id>\d)'], ['sum_{det}'],
+                         function='tests.test_pieces.count_inputs')
+    for name in ['A_1', 'A_2', 'A_ref1', 'A_ref2', 'B_1', 'B_ref1']:
+        t.consider(HistObject(name, None))
+    t.catalog()
+    assert not t.fire_incomplete()
+    # A_ref2 and everything of B never arrive
+    om = CollectingOutputModule()
+    eventloop([HistObject(_, _) for _ in ['A_1', 'A_2', 'A_ref1']], om, [t],
+              argparse.Namespace(defer=False), logging.getLogger(__name__))
+    # transformed at the end of the pass, with the complete combination only
+    assert [(_.name, _.hist) for _ in om.objects] == [('sum_A', 1)]
+    assert not t.fire_incomplete()
+    # once the missing input arrives, the group is complete and fires as usual
+    assert [_.hist for _ in t.consider(HistObject('A_ref2', 'A_ref2'))] == [2]
+    assert not t.fire_incomplete()
+
+
+def count_inputs(inputs):
+    """ Test transform function: number of input combinations """
+    return [len(list(inputs))]
+
+
+def test_pool_executor_order():
+    import threading
+    from histgrinder.HistObject import HistObject
+    from histgrinder.executor import make_executor, SerialExecutor
+    results = {}
+    for jobs, backend, forkbatches, threaded in [(1, 'thread', False, False), (4, 'thread', False, False),
+                                                 (4, 'process', False, False), (4, 'process', True, False),
+                                                 (4, 'process', True, True)]:
+        executor = make_executor(jobs, backend, forkbatches)
+        assert isinstance(executor, SerialExecutor)
+        transformers = [make_transformer([r'(?P<det>A|B|C)_(?P<thr>hi|lo)'], ['summary_{det}']),
+                        make_transformer([r'(?P<det>A|B|C)_(?P<thr>hi|lo)'], ['summary_{thr}'])]
+        for t in transformers:
+            for name in [f'{d}_{thr}' for d in 'ABC' for thr in ('hi', 'lo')]:
+                t.consider(HistObject(name, name), defer=True)
+        # another thread running (like the reader of --pipeline) rules out forking
+        stop = threading.Event()
+        other = threading.Thread(target=stop.wait)
+        if threaded:
+            other.start()
+        try:
+            results[(jobs, backend, forkbatches, threaded)] = [(_.name, _.hist)
+                                                               for _ in executor.transform(transformers)]
+            if backend == 'process':
+                assert (executor.pool is None) == (forkbatches and not threaded)
+        finally:
+            stop.set()
+            if threaded:
+                other.join()
+        executor.shutdown()
+    reference = results[(1, 'thread', False, False)]
+    assert len(reference) == 5
+    assert all(_ == reference for _ in results.values())
+
+
+def test_chain():
+    import pytest
+    from histgrinder.HistObject import HistObject
+    from histgrinder.transform import Dispatcher
+    from histgrinder.executor import SerialExecutor
+    from histgrinder.chain import Chain
+
+    def setup():
+        # deliberately configured downstream-first
+        transformers = [make_transformer([r'summary_(?P<det>A|B|C)'], ['total']),
+                        make_transformer([r'(?P<det>A|B|C)_(?P<thr>hi|lo)'], ['summary_{det}'])]
+        dispatcher = Dispatcher(transformers)
+        for name in names:
+            dispatcher.consider(HistObject(name, None))
+        chain = Chain(transformers, dispatcher, skip_intermediates=True)
+        return transformers, chain
+
+    names = [f'{d}_{thr}' for d in 'ABC' for thr in ('hi', 'lo')]
+    transformers, chain = setup()
+    assert chain.plan() == transformers[::-1]
+    assert len(transformers[0].hits[0]) == 3
+    # streaming
+    out = []
+    for name in names:
+        for t, matches in chain.dispatcher.dispatch(name):
+            t.accept(HistObject(name, name), matches, defer=True)
+            out += chain.feed(t.transform(), SerialExecutor())
+    assert [_.name for _ in out] == ['total']
+    assert len(out[0].hist) == 3
+    # deferred
+    transformers, chain = setup()
+    chain.plan()
+    for name in names:
+        chain.dispatcher.consider(HistObject(name, name), defer=True)
+    assert [_.name for _ in chain.run_deferred(SerialExecutor())] == ['total']
+
+    # cycles are rejected
+    transformers = [make_transformer([r'x_(?P<id>\d)'], ['y_{id}']), make_transformer([r'y_(?P<id>\d)'], ['x_{id}'])]
+    dispatcher = Dispatcher(transformers)
+    dispatcher.consider(HistObject('x_1', None))
+    with pytest.raises(ValueError):
+        Chain(transformers, dispatcher).plan()
+
+
+def test_prefix_filter():
+    import re
+    from histgrinder.patterns import PrefixFilter
+    f = PrefixFilter([re.compile(r'gaussians/gaus_(?P<id>\d+)'), re.compile(r'det(?P<d>A|B)/eff')])
+    assert f('gaussians')
+    assert not f('gaussians/sub')
+    assert not f('other')
+    assert f('detA') and f('detC')  # literal prefix is only 'det'
+    assert PrefixFilter([re.compile(r'(?P<d>\w+)/eff')])('anything')
+
+
+def test_content_hash():
+    from histgrinder.hashing import content_hash
+    assert content_hash([1., 2.]) == content_hash([1., 2.])
+    assert content_hash([1., 2.]) != content_hash([1., 3.])
+
+
+def batch_ratio(contents, groups, scale=1):
+    """ Test batch function: ratio of the two slots of each group """
+    assert contents.shape[:2] == (len(groups), 2)
+    return scale * contents[:, 0:1, :] / contents[:, 1:2, :]
+
+
+def test_batch():
+    np = pytest.importorskip("numpy")
+    from histgrinder.HistObject import HistObject
+    t = make_transformer([r'h_(?P<id>\d)', r'ref_(?P<id>\d)'], ['ratio_{id}'],
+                         function='tests.test_pieces.batch_ratio', Batch=True, Parameters={'scale': 2})
+    for i in range(3):
+        t.consider(HistObject(f'h_{i}', np.full(4, i + 1.)), defer=True)
+        t.consider(HistObject(f'ref_{i}', np.full(4, 2.)), defer=True)
+    units = t.prepare()
+    assert len(units) == 1 and len(units[0]) == 3
+    out = t.outputs(units[0], t.call(units[0]))
+    assert [_.name for _ in out] == ['ratio_0', 'ratio_1', 'ratio_2']
+    assert [list(_.hist) for _ in out] == [[1.] * 4, [2.] * 4, [3.] * 4]
+
+
+def test_batch_config():
+    from histgrinder.config import TransformationConfiguration
+    with pytest.raises(ValueError):
+        TransformationConfiguration(Input=['a'], Function='f', Description='d', VariableOutput=True, Batch=True)
+
+
+def test_eviction():
+    from histgrinder.HistObject import HistObject
+    from histgrinder.transform import Dispatcher
+    from histgrinder.memory import EvictionTracker
+    # the 'eff' histograms feed two groups of the first transformer, and the second
+    transformers = [make_transformer([r'(?P<det>A|B)_(?P<thr>hi|lo)', r'(?P<det>A|B)_eff'], ['summary_{det}_{thr}']),
+                    make_transformer([r'(?P<det>A|B)_eff'], ['effs'])]
+    names = ['A_hi', 'A_lo', 'B_hi', 'B_lo', 'A_eff', 'B_eff']
+    dispatcher = Dispatcher(transformers)
+    for name in names:
+        dispatcher.consider(HistObject(name, None))
+    tracker = EvictionTracker(transformers)
+    assert tracker.remaining['A_eff'] == 3
+    out = []
+    for name in ['A_eff', 'A_hi', 'B_eff', 'B_hi', 'A_lo']:
+        out += dispatcher.consider(HistObject(name, name))
+    # every group using the A inputs has fired, so they have been released
+    assert [_.name for _ in out] == ['summary_A_hi', 'effs', 'summary_B_hi', 'summary_A_lo']
+    assert transformers[0].hits[0][('A', 'hi')].hist is None
+    assert transformers[0].hits[1][('A',)].hist is None
+    assert transformers[0].hits[1][('B',)].hist == 'B_eff'
+    out = dispatcher.consider(HistObject('B_lo', 'B_lo'))
+    assert [_.name for _ in out] == ['summary_B_lo']
+    assert tracker.nevicted == 6
+
+    # a second pass over the input (which go() does not allow with --evict) must not transform a group
+    # with only the inputs received again
+    t = make_transformer([r'h_(?P<i>\d)'], ['sum'], function='tests.test_pieces.count_inputs')
+    dispatcher = Dispatcher([t])
+    names = [f'h_{i}' for i in range(1, 5)]
+    for name in names:
+        dispatcher.consider(HistObject(name, None))
+    EvictionTracker([t])
+    out = []
+    for name in names:
+        out += dispatcher.consider(HistObject(name, name))
+    assert [(_.name, _.hist) for _ in out] == [('sum', 4)]
+    assert not dispatcher.consider(HistObject('h_3', 'h_3 changed'))
+    assert not t.fire_incomplete()
+    # once all the inputs are there again, the group is transformed as usual
+    out = []
+    for name in ['h_1', 'h_2', 'h_4']:
+        out += dispatcher.consider(HistObject(name, name))
+    assert [(_.name, _.hist) for _ in out] == [('sum', 4)]
+
+
+def test_lazy_loading():
+    from histgrinder.HistObject import HistObject, Loader, LoaderCache
+    from histgrinder.transform import Dispatcher
+
+    class CountingLoader(Loader):
+        nloads = 0
+
+        def __init__(self, value):
+            super().__init__()
+            self.value = value
+
+        def load(self):
+            CountingLoader.nloads += 1
+            return self.value
+
+    transformers = [make_transformer([r'(?P<det>A|B)_hi', r'(?P<det>A|B)_lo'], ['summary_{det}'])]
+    dispatcher = Dispatcher(transformers)
+    out = []
+    for name in ['A_hi', 'B_hi', 'A_lo']:
+        out += dispatcher.consider(HistObject(name, CountingLoader(name)))
+    # B_hi never forms a complete group, so it is never read
+    assert [_.name for _ in out] == ['summary_A']
+    assert CountingLoader.nloads == 2
+    assert not isinstance(transformers[0].hits[0][('B',)].hist, Loader)
+    assert CountingLoader.nloads == 3
+
+    CountingLoader.nloads = 0
+    Loader.cache = LoaderCache(2)
+    try:
+        loaders = [CountingLoader(_) for _ in range(3)]
+        assert [_.get() for _ in loaders] == [0, 1, 2]
+        # the least recently used one has been dropped and is read again
+        assert loaders[0].obj is None and loaders[2].obj == 2
+        assert loaders[0].get() == 0
+        assert loaders[1].obj is None
+        assert CountingLoader.nloads == 4
+    finally:
+        Loader.cache = None
+
+
+def test_lazy_loading_threads():
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from histgrinder.HistObject import HistObject, Loader, LoaderCache
+
+    class ExclusiveLoader(Loader):
+        # like a shared input file: only one load at a time
+        active = 0
+        overlaps = 0
+
+        def __init__(self, value):
+            super().__init__()
+            self.value = value
+
+        def load(self):
+            ExclusiveLoader.active += 1
+            if ExclusiveLoader.active > 1:
+                ExclusiveLoader.overlaps += 1
+            time.sleep(0.001)
+            ExclusiveLoader.active -= 1
+            return self.value
+
+    Loader.cache = LoaderCache(5)
+    try:
+        objs = [HistObject(str(_), ExclusiveLoader(_)) for _ in range(20)]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            values = list(pool.map(lambda o: o.hist, objs * 3))
+        assert values == list(range(20)) * 3
+        assert ExclusiveLoader.overlaps == 0
+        assert len(Loader.cache.entries) == 5
+    finally:
+        Loader.cache = None
+
+
+def test_result_cache(tmp_path):
+    import os
+    from histgrinder.HistObject import HistObject
+    from histgrinder.cache import ResultCache
+    from histgrinder.executor import make_executor
+
+    def run(cache, contents, jobs=1):
+        t = make_transformer([r'(?P<det>A|B)_(?P<thr>hi|lo)'], ['summary_{det}'])
+        t.cache = cache
+        for name in ['A_hi', 'A_lo', 'B_hi', 'B_lo']:
+            t.consider(HistObject(name, contents.get(name, name)), defer=True)
+        executor = make_executor(jobs)
+        rv = [(_.name, _.hist) for _ in executor.transform([t])]
+        executor.shutdown()
+        return rv
+
+    cache = ResultCache(str(tmp_path))
+    first = run(cache, {})
+    assert (cache.hits, cache.misses, cache.stores) == (0, 2, 2)
+    # unchanged inputs are served from the cache, by either executor
+    assert run(cache, {}) == first
+    assert run(cache, {}, jobs=2) == first
+    assert (cache.hits, cache.misses) == (4, 2)
+    # a changed input only invalidates its own group
+    changed = run(cache, {'B_lo': 'new'})
+    assert changed[0] == first[0] and changed[1] == ('summary_B', [('B_hi',), ('new',)])
+    assert (cache.hits, cache.misses) == (5, 3)
+
+    # least recently used entries go when the size limit is exceeded
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 3
+    small = ResultCache(str(tmp_path), maxbytes=cache.size - 1)
+    assert small.size == cache.size
+    run(small, {'A_hi': 'newer'})
+    assert small.evictions >= 1 and small.size <= small.maxbytes
+
+
+def test_benchmarks():
+    from histgrinder.benchmarks.throughput import run, main
+    from histgrinder.benchmarks.modules import SyntheticInputModule
+    im = SyntheticInputModule()
+    im.configure({'source': 'blocks=2,hists=12'})
+    assert len(im) == 48 and len(list(im)) == 48
+    expected = {'single': 24, 'join': 24, 'reduce': 2, 'groups': 40}
+    for scenario, ntransforms in expected.items():
+        results = {_['phase']: _ for _ in run(scenario, 2, 12)}
+        assert results['transform']['transforms'] == ntransforms
+        assert results['eventloop']['names'] == results['consider']['names'] > 0
+    assert len(main(['--scenario', 'mixed', '--blocks', '3', '--hists', '5'])) == 3
+
+
+def test_statistics(tmp_path):
+    import argparse
+    import json
+    import logging
+    from histgrinder import stats
+    from histgrinder.engine import eventloop
+    from histgrinder.transform import Dispatcher
+    from histgrinder.benchmarks.modules import SyntheticInputModule, NullOutputModule
+    transformers = [make_transformer([r'det0/hist_(?P<id>\d+)', r'det0/ref_(?P<id>\d+)'], ['ratio_{id}']),
+                    make_transformer([r'det1/hist_\d+'], ['summary'])]
+    dispatcher = Dispatcher(transformers)
+    im = SyntheticInputModule()
+    im.configure({'blocks': 3, 'hists': 4})
+    om = NullOutputModule()
+    eventloop(im, om, transformers, argparse.Namespace(defer=False), logging.getLogger(), dispatcher)
+    report = stats.collect(dispatcher, im, om)
+    first, second = report['transformers']
+    assert (first['matches'], first['calls'], first['outputs'], first['hits_held']) == (8, 4, 4, 8)
+    # the summary is remade for every new input
+    assert (second['matches'], second['calls'], second['outputs']) == (4, 4, 4)
+    assert first['regex_tests'] >= first['matches']
+    assert report['input'] == {'names_listed': 24}
+    assert report['output'] == {'objects_published': 8}
+    assert stats.format_table(report).count('Test') == 2
+    stats.write(report, str(tmp_path / 'stats.json'))
+    assert json.load(open(tmp_path / 'stats.json')) == report
+
+
+def test_configuration_cache(tmp_path):
+    import os
+    from histgrinder.config import read_configuration, ConfigurationCache
+    path = str(tmp_path / 'config.yaml')
+    with open('tests/test_functional.yaml') as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text)
+    cache = ConfigurationCache()
+    first = read_configuration(path, cache)
+    assert os.path.exists(ConfigurationCache.cachename(path))
+    assert [repr(_) for _ in read_configuration(path, cache)] == [repr(_) for _ in first]
+    assert (cache.hits, cache.misses) == (1, 1)
+    # rewritten with the same content: found by the hash
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    read_configuration(path, cache)
+    assert (cache.hits, cache.misses) == (2, 1)
+    with open(path, 'w') as f:
+        f.write(text.replace('Testing1', 'Changed'))
+    assert read_configuration(path, cache)[0].description == 'Changed'
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_lazy_function_lookup():
+    import sys
+    # errors that can be found without importing the module are reported at once
+    with pytest.raises(ValueError, match='math.pi does not appear to be callable'):
+        make_transformer(['a'], ['b'], function='math.pi')
+    with pytest.raises(ValueError, match="No module named 'histgrinder.nonexistent'"):
+        make_transformer(['a'], ['b'], function='histgrinder.nonexistent.function')
+    with pytest.raises(ValueError, match="No module named 'nonexistent'"):
+        make_transformer(['a'], ['b'], function='nonexistent.function')
+    assert make_transformer(['a'], ['b'], function='math.sqrt').transform_function(4) == 2
+    # other modules are only imported when the function is needed
+    sys.modules.pop('histgrinder.vectorized', None)
+    t = make_transformer(['a'], ['b'], function='histgrinder.vectorized.nonexistent')
+    assert 'histgrinder.vectorized' not in sys.modules
+    with pytest.raises(ValueError, match='Unable to instantiate transformer'):
+        t.transform_function
+
+
+def test_expand_sources(tmp_path):
+    from histgrinder.sources import expand_sources, source_labels
+    for name in ['run2.root', 'run1.root', 'other.txt']:
+        (tmp_path / name).write_text('')
+    listing = tmp_path / 'list.txt'
+    listing.write_text('# comment\nroot://server//a/run1.root\n\nb.root\n')
+    sources = expand_sources([str(tmp_path / 'run*.root'), f'@{listing}', 'c.root'])
+    assert sources == [str(tmp_path / 'run1.root'), str(tmp_path / 'run2.root'),
+                       'root://server//a/run1.root', 'b.root', 'c.root']
+    assert source_labels(sources) == ['run1_1', 'run2', 'run1_2', 'b', 'c']
+    with pytest.raises(ValueError):
+        expand_sources([str(tmp_path / 'missing*.root')])
+
+
+def test_pipeline():
+    import argparse
+    import logging
+    from histgrinder.engine import eventloop
+    from histgrinder.benchmarks.modules import SyntheticInputModule
+    from histgrinder.sources import CollectingOutputModule
+
+    class RecordingOutputModule(CollectingOutputModule):
+        def __init__(self):
+            super().__init__()
+            self.published = []
+
+        def publish(self, obj):
+            self.published.extend((_.name, _.hist) for _ in obj)
+
+    def run(queue_size=None, defer=False, outmodule=RecordingOutputModule, inputs=None):
+        transformers = [make_transformer([r'det0/hist_(?P<id>\d+)', r'det0/ref_(?P<id>\d+)'], ['ratio_{id}']),
+                        make_transformer([r'det1/hist_\d+'], ['summary'])]
+        im = SyntheticInputModule()
+        im.configure({'blocks': 3, 'hists': 20})
+        om = outmodule()
+        args = argparse.Namespace(defer=defer, pipeline=queue_size is not None, queue_size=queue_size)
+        eventloop(im, om, transformers, args, logging.getLogger(), inputs=inputs)
+        return om.published
+
+    for defer in (False, True):
+        expected = run(defer=defer)
+        assert expected
+        assert run(queue_size=1, defer=defer) == expected
+        assert run(queue_size=100, defer=defer) == expected
+
+    class FailingOutputModule(RecordingOutputModule):
+        def publish(self, obj):
+            raise RuntimeError('cannot write')
+
+    with pytest.raises(RuntimeError, match='cannot write'):
+        run(queue_size=1, outmodule=FailingOutputModule)
+
+    def failing_inputs():
+        from histgrinder.HistObject import HistObject
+        yield HistObject('det0/hist_1', 1)
+        raise OSError('cannot read')
+
+    with pytest.raises(OSError, match='cannot read'):
+        run(queue_size=1, inputs=failing_inputs())
+
+    class PollingOutputModule(RecordingOutputModule):
+        polls = 0
+
+        def poll(self):
+            PollingOutputModule.polls += 1
+
+    def slow_inputs():
+        import time
+        from histgrinder.HistObject import HistObject
+        yield HistObject('det0/hist_1', 1)
+        time.sleep(0.5)
+        yield HistObject('det2/hist_1', 1)
+
+    # the writer gets the chance to write queued outputs while no input comes
+    for queue_size in (None, 1):
+        PollingOutputModule.polls = 0
+        run(queue_size=queue_size, outmodule=PollingOutputModule, inputs=slow_inputs())
+        assert PollingOutputModule.polls >= (2 if queue_size is None else 3)
+
+
+def test_columnar_store(tmp_path):
+    np = pytest.importorskip("numpy")
+    import re
+    from histgrinder.HistObject import HistObject
+    from histgrinder.io.columnar import ColumnarInputModule, ColumnarOutputModule, ArrayHist
+    path = str(tmp_path / 'store.hgc')
+    om = ColumnarOutputModule()
+    om.configure({'target': path, 'prefix': 'prefix'})
+    om.publish([HistObject('a/h1', np.arange(5.)),
+                HistObject('a/h2', ArrayHist(np.ones((3, 4), dtype='i4'), flow=True, title='two')),
+                HistObject('b/bad', object())])
+    om.finalize()
+    assert om.statistics()['objects_written'] == 2
+
+    im = ColumnarInputModule()
+    im.configure({'source': path, 'prefix': '/prefix'})
+    im.setSelectors([re.compile(r'a/h\d')])
+    assert [(_.name, _.hist) for _ in im.warmup()] == [('a/h1', None), ('a/h2', None)]
+    objs = {_.name: _.hist for _ in im}
+    assert list(np.asarray(objs['a/h1'])) == [0., 1., 2., 3., 4.]
+    h2 = objs['a/h2']
+    assert h2.values.dtype == np.dtype('i4') and h2.shape == (3, 4) and h2.flow and h2.title == 'two'
+    assert [len(_) for _ in h2.edges] == [2, 3]
+    # arrays are read-only views of the mapped file
+    assert not h2.values.flags.writeable and h2.values.ctypes.data % 64 == 0
+
+    # appending replaces histograms of the same name; readers see the new index
+    om = ColumnarOutputModule()
+    om.configure({'target': path, 'prefix': 'prefix'})
+    om.publish(HistObject('a/h1', np.zeros(2)))
+    om.finalize()
+    assert list(next(iter(im)).hist.values) == [0., 0.]
+    assert len(list(im)) == 2
+
+    # while a writer is appending, readers see the histograms of the last index
+    om = ColumnarOutputModule()
+    om.configure({'target': path, 'prefix': 'prefix'})
+    om.publish(HistObject('a/h3', np.ones(1000)))
+    assert sorted(_.name for _ in im) == ['a/h1', 'a/h2']
+    om.finalize()
+    assert sorted(_.name for _ in im) == ['a/h1', 'a/h2', 'a/h3']
+    im.close()
+
+
+def test_checkpoint(tmp_path):
+    from histgrinder.HistObject import HistObject
+    from histgrinder.checkpoint import Checkpointer
+
+    class Input(object):
+        def __init__(self):
+            self.state = None
+
+        def checkpoint(self):
+            return {'read': ['A_hi']}
+
+        def restore(self, state):
+            self.state = state
+
+    def make():
+        return [make_transformer([r'(?P<det>A|B)_hi', r'(?P<det>A|B)_lo'], ['summary_{det}']),
+                make_transformer([r'C'], ['copy'])]
+    transformers = make()
+    transformers[0].consider(HistObject('A_hi', 1))
+    transformers[0].consider(HistObject('B_lo', 2))
+    path = str(tmp_path / 'job.ckpt')
+    checkpointer = Checkpointer(path, interval=0)
+
+    class Output(object):
+        def __init__(self):
+            self.flushed = []
+
+        def flush(self):
+            self.flushed.append(checkpointer.nsaves)
+
+    # a checkpoint is written before each input is handed out, after flushing the output
+    om = Output()
+    assert list(checkpointer.wrap(['x', 'y'], transformers, Input(), om)) == ['x', 'y']
+    assert checkpointer.nsaves == 3
+    assert om.flushed == [0, 1, 2]
+
+    state = Checkpointer(path).load()
+    restored, im = make(), Input()
+    assert Checkpointer(path).restore(state, restored, im)
+    assert im.state == {'read': ['A_hi']}
+    assert {tup: obj.hist for tup, obj in restored[0].hits[0].items()} == {('A',): 1}
+    assert {tup: obj.hist for tup, obj in restored[0].hits[1].items()} == {('B',): 2}
+    assert list(restored[0].matchqueue) == list(transformers[0].matchqueue)
+    # the held histograms complete matches as if the job had not stopped
+    assert [_.name for _ in restored[0].consider(HistObject('A_lo', 3))] == ['summary_A']
+
+    # a different configuration doesn't take the state
+    other = [make_transformer([r'(?P<det>A|B)_hi', r'(?P<det>A|B)_lo'], ['other_{det}'])]
+    assert not Checkpointer(path).restore(state, other, Input())
+    assert not other[0].hits[0]
+    assert Checkpointer(str(tmp_path / 'none')).load() is None
+
+
+def test_partition():
+    from histgrinder.workers import partition
+    transformers = [make_transformer([r'A_(?P<id>\d)'], ['a']),
+                    make_transformer([r'B_(?P<id>\d)'], ['b']),
+                    make_transformer([r'(?P<det>A|C)_1'], ['ac']),
+                    make_transformer([r'B_(?P<id>\d)'], ['b2']),
+                    make_transformer([r'D'], ['d'])]
+    names = ['A_1', 'A_2', 'B_1', 'B_2', 'B_3', 'B_4', 'C_1', 'D']
+    # same regex (1, 3) or same inputs (0, 2) share a worker; largest groups first
+    assert partition(transformers, names, 2) == [[1, 3], [0, 2, 4]]
+    assert partition(transformers, names, 3) == [[1, 3], [0, 2], [4]]
+    assert partition(transformers, names, 10) == [[1, 3], [0, 2], [4]]
+    assert partition(transformers, names, 1) == [[0, 1, 2, 3, 4]]
+
+
+def test_trace(tmp_path):
+    import json
+    from histgrinder import trace
+    from histgrinder.HistObject import HistObject
+    # disabled: nothing is recorded
+    assert trace.span('consider', 'match', input='x') is trace.span('other', 'read')
+    t = make_transformer([r'(?P<det>A|B)_hi', r'(?P<det>A|B)_lo'], ['summary_{det}'])
+    tracer = trace.enable()
+    try:
+        t.consider(HistObject('A_hi', 1))
+        t.consider(HistObject('A_lo', 2))
+    finally:
+        trace.disable()
+    t.consider(HistObject('B_hi', 1))
+    path = tmp_path / 'trace.json'
+    tracer.write(str(path))
+    events = json.loads(path.read_text())['traceEvents']
+    spans = [_ for _ in events if _['ph'] == 'X']
+    assert [(_['cat'], _['name']) for _ in spans] == [('match', 'consider'), ('transform', 'Test'),
+                                                      ('match', 'consider')]
+    assert spans[0]['args'] == {'input': 'A_hi', 'transformation': 'Test'}
+    assert spans[1]['args'] == {'group': ['A']}
+    # the function call is inside the consider span that triggered it
+    assert spans[2]['ts'] <= spans[1]['ts'] and spans[1]['ts'] + spans[1]['dur'] <= spans[2]['ts'] + spans[2]['dur']
+    assert any(_['name'] == 'thread_name' for _ in events)
+
+    # the buffer keeps only the latest spans
+    tracer = trace.enable(maxevents=2)
+    try:
+        for i in range(5):
+            with trace.span(f'span{i}', 'test'):
+                pass
+    finally:
+        trace.disable()
+    assert [_['name'] for _ in tracer.events] == ['span3', 'span4']
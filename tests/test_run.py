@@ -20,6 +20,31 @@ def returncppstr(inputs):
     return [cppyy.gbl.std.string('abc')]
 
 
+def failing_transform(inputs):
+    import time
+    time.sleep(0.5)
+    raise RuntimeError('bad block')
+
+
+def large_output(inputs):
+    return ['x' * 100000]
+
+
+def sum_ROOT(inputs):
+    hists = [_[1][0] for _ in inputs]
+    rv = hists[0].Clone('sum')
+    for h in hists[1:]:
+        rv.Add(h)
+    return [rv]
+
+
+def count_ROOT(inputs):
+    import ROOT
+    rv = ROOT.TH1F('count', 'count', 1, 0, 1)
+    rv.Fill(0.5, len(list(inputs)))
+    return [rv]
+
+
 def test_run_stream():
     pytest.importorskip("ROOT")
 
@@ -109,6 +134,23 @@ def test_run_defer():
     return content_verify()
 
 
+def test_run_oncomplete():
+    pytest.importorskip("ROOT")
+
+    import subprocess
+    chk = subprocess.run("python -m histgrinder.make_sample_file",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    print(chk.stdout)
+    chk.check_returncode()
+    chk = subprocess.run("python -m histgrinder.engine example.root example.root "
+                         "-c tests/test_functional.yaml --prefix prefix --oncomplete",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    print(chk.stdout)
+    chk.check_returncode()
+
+    return content_verify()
+
+
 def test_run_delaywrite():
     pytest.importorskip("ROOT")
 
@@ -126,6 +168,24 @@ def test_run_delaywrite():
     return content_verify()
 
 
+def test_run_persistent_output():
+    pytest.importorskip("ROOT")
+
+    import subprocess
+    chk = subprocess.run("python -m histgrinder.make_sample_file",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    print(chk.stdout)
+    chk.check_returncode()
+    chk = subprocess.run("python -m histgrinder.engine example.root example.root "
+                         "-c tests/test_functional.yaml --prefix prefix --persistent-output --flush-count 7",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    print(chk.stdout)
+    chk.check_returncode()
+    assert b'with 1 file opens' in chk.stdout
+
+    return content_verify()
+
+
 def test_run_badpattern():
     pytest.importorskip("ROOT")
 
@@ -291,3 +351,143 @@ Description: Testing
                 b' Mapping where at least one of the keys is not a string.' in chk.stdout)
         with pytest.raises(CalledProcessError):
             chk.check_returncode()
+
+
+def test_run_multisource(tmp_path):
+    import json
+    import subprocess
+    from histgrinder.benchmarks.configs import make_yaml
+    config = tmp_path / 'join.yaml'
+    config.write_text(make_yaml('join', 2))
+    for extra in ['', '--source-jobs 2']:
+        chk = subprocess.run("python -m histgrinder.engine blocks=2,hists=3 blocks=1,hists=3 null "
+                             f"-c {config} --stats {tmp_path / 'stats.json'} {extra} "
+                             "--inmodule histgrinder.benchmarks.modules.SyntheticInputModule "
+                             "--outmodule histgrinder.benchmarks.modules.NullOutputModule",
+                             shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        print(chk.stdout)
+        chk.check_returncode()
+        report = json.loads((tmp_path / 'stats.json').read_text())
+        assert list(report['sources']) == ['blocks=2,hists=3', 'blocks=1,hists=3']
+        assert [_['output']['objects_collected'] for _ in report['sources'].values()] == [6, 3]
+        assert report['output']['objects_published'] == 9
+    chk = subprocess.run("python -m histgrinder.engine blocks=1 blocks=2 null --merge separate "
+                         f"-c {config} --inmodule histgrinder.benchmarks.modules.SyntheticInputModule "
+                         "--outmodule histgrinder.benchmarks.modules.NullOutputModule",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert b'the target must contain {label} or {index}' in chk.stdout
+
+
+def test_run_workers(tmp_path):
+    import json
+    import subprocess
+    from histgrinder.benchmarks.configs import make_yaml
+    config = tmp_path / 'mixed.yaml'
+    config.write_text(make_yaml('mixed', 6))
+    chk = subprocess.run("python -m histgrinder.engine blocks=6,hists=5 null --workers 3 "
+                         f"-c {config} --stats {tmp_path / 'stats.json'} "
+                         "--inmodule histgrinder.benchmarks.modules.SyntheticInputModule "
+                         "--outmodule histgrinder.benchmarks.modules.NullOutputModule",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    print(chk.stdout)
+    chk.check_returncode()
+    report = json.loads((tmp_path / 'stats.json').read_text())
+    assert [len(_['transformers']) for _ in report['workers']] == [2, 2, 2]
+    assert sum(_['output']['objects_sent'] for _ in report['workers']) == 31
+    assert report['output']['objects_published'] == 31
+    chk = subprocess.run("python -m histgrinder.engine blocks=1 null --workers 2 --chain "
+                         f"-c {config} --inmodule histgrinder.benchmarks.modules.SyntheticInputModule "
+                         "--outmodule histgrinder.benchmarks.modules.NullOutputModule",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert b'--workers can not be used with' in chk.stdout
+    chk = subprocess.run("python -m histgrinder.engine blocks=1 null --evict --watch 1 "
+                         f"-c {config} --inmodule histgrinder.benchmarks.modules.SyntheticInputModule "
+                         "--outmodule histgrinder.benchmarks.modules.NullOutputModule",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert b'--evict can not be used with' in chk.stdout
+
+
+def test_run_workers_failure(tmp_path):
+    import subprocess
+    import yaml
+    config = tmp_path / 'failing.yaml'
+    config.write_text(yaml.safe_dump_all([
+        {'Input': [r'det0/hist_(?P<id>\d+)'], 'Output': ['bad_{id}'], 'Function': 'tests.test_run.failing_transform',
+         'Description': 'bad'},
+        {'Input': [r'det1/hist_(?P<id>\d+)'], 'Output': ['det1/copy_{id}'], 'Function': 'tests.test_run.large_output',
+         'Description': 'busy'}]))
+    # one worker fails while the other is still sending outputs: the job must stop, not hang
+    chk = subprocess.run("python -m histgrinder.engine blocks=2,hists=5000 null --workers 2 "
+                         f"-c {config} --inmodule histgrinder.benchmarks.modules.SyntheticInputModule "
+                         "--outmodule histgrinder.benchmarks.modules.NullOutputModule",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+    print(chk.stdout.decode())
+    assert chk.returncode != 0
+    assert b'RuntimeError: Worker 0 failed: RuntimeError: bad block' in chk.stdout
+    assert chk.stdout.count(b'failed') == 2
+
+
+def write_inputs(filename, contents, mode='UPDATE'):
+    """ Write a one-bin histogram h_<i> with each content (a new key cycle for existing ones) """
+    import ROOT
+    f = ROOT.TFile.Open(filename, mode)
+    for i, content in contents.items():
+        h = ROOT.TH1F(f'h_{i}', f'h_{i}', 1, 0, 1)
+        h.SetBinContent(1, content)
+        h.Write()
+    f.Close()
+
+
+def wait_for(proc, text, count):
+    """ Read the output of proc until text has been seen count times """
+    lines = []
+    for line in proc.stdout:
+        lines.append(line)
+        if text in line:
+            count -= 1
+            if not count:
+                return lines
+    raise AssertionError(b''.join(lines).decode())
+
+
+@pytest.mark.parametrize('options', ['', '--persistent-output --skip-unchanged'])
+def test_run_watch(tmp_path, options):
+    ROOT = pytest.importorskip("ROOT")
+    import subprocess
+    import threading
+    import yaml
+    source, target = str(tmp_path / 'in.root'), str(tmp_path / 'out.root')
+    write_inputs(source, {1: 1, 2: 2, 3: 3, 4: 4, 5: 5}, 'RECREATE')
+    config = tmp_path / 'watch.yaml'
+    config.write_text(yaml.safe_dump_all([
+        {'Input': [r'h_(?P<i>[1-4])'], 'Output': ['sum'], 'Function': 'tests.test_run.sum_ROOT',
+         'Description': 'sum'},
+        {'Input': [r'h_(?P<i>\d)'], 'Output': ['count'], 'Function': 'tests.test_run.count_ROOT',
+         'Description': 'count'}]))
+    proc = subprocess.Popen(f"exec python -m histgrinder.engine {source} {target} -c {config} --watch 0.2 {options}",
+                            shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    watchdog = threading.Timer(60, proc.kill)
+    watchdog.start()
+    try:
+        lines = wait_for(proc, b'Finalizing output', 1)
+        # second pass: a changed input refires both transformations
+        write_inputs(source, {3: 30})
+        lines += wait_for(proc, b'Finalizing output', 2)
+        # third pass: a changed input which leaves every output unchanged
+        write_inputs(source, {5: 50})
+        lines += wait_for(proc, b'Finalizing output', 2)
+        assert proc.poll() is None, b''.join(lines).decode()
+    finally:
+        watchdog.cancel()
+        proc.terminate()
+        proc.wait()
+    # the statistics of the last pass come after its 'Finalizing output'
+    lines += proc.stdout.readlines()
+    print(b''.join(lines).decode())
+    f = ROOT.TFile.Open(target)
+    assert f.Get('sum').GetBinContent(1) == 37
+    assert f.Get('count').GetBinContent(1) == 5
+    f.Close()
+    written = [_ for _ in lines if b'ROOT output: wrote' in _][-1]
+    # without --skip-unchanged, count is written on every pass
+    assert f'wrote {3 if options else 5} objects'.encode() in written